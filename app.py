@@ -1,18 +1,30 @@
-from flask import Flask, render_template, request, url_for, redirect, flash, abort, jsonify
+from flask import Flask, render_template, request, url_for, redirect, flash, abort, jsonify, current_app, \
+    send_from_directory
 from flask_login import LoginManager, login_required, login_user, current_user, logout_user
 import jinja2
-from models import User, Post, PostUser, Tag, PostTag, Settings, postgres_db
+import click
+from models import User, Post, PostUser, Tag, PostTag, Settings, Job, PostIndex, PostMonth, database, open_database, uses_sqlite
 from functools import wraps
 import json
-import bcrypt
-import markdown
 import datetime
 import peewee
-from mdx_gfm import GithubFlavoredMarkdownExtension as GithubMarkdown
 from playhouse.shortcuts import model_to_dict
 from playhouse.postgres_ext import *
 from pagination import Pagination
+from cache import RecentPosts, UserCache, PostSlugs, ResultCache
+from ratelimit import RateLimiter
+from passwords import PasswordHasher, TooManyAttempts
+from compression import Compressor, load_brotli
+from profiler import Profiler
+import assets
+import render
+import jobs
+import export
+import sitemap
 import util
+import queries
+import gc
+import os
 
 
 # TODO: Proper Responsiveness
@@ -23,39 +35,170 @@ import util
 ########################################
 
 ### Initialize app ###
-app = Flask(__name__)
-app.config.from_object("config.Config")
+
+# Routes, error handlers, template helpers and commands get declared on this stand-in and registered on every app
+# create_app builds
+routes = util.DeferredApp()
+
+def create_app(config="config.Config"):
+    """
+    Builds the app. config is a config object or the import path of one. The app gets a database, caches, hasher,
+    limiter, compressor and profiler of its own in app.extensions, so apps of different configs can live side by side.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    if app.config['TEMPLATE_CACHE_FOLDER']:
+        os.makedirs(app.config['TEMPLATE_CACHE_FOLDER'], exist_ok=True)
+        bytecode_cache = assets.TemplateBytecodeCache(app.config['TEMPLATE_CACHE_FOLDER'])
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=bytecode_cache)
+    app.jinja_env.trim_blocks = True
+    app.jinja_env.lstrip_blocks = True
+
+    # The models' database proxy (see models.py) and the helpers below look these up through current_app
+    app.extensions['database'] = open_database(app.config['DATABASE_URL'], app.config['SQLITE_PRAGMAS'])
+    auth.init_app(app)
+
+    app.extensions['user_cache'] = UserCache(ttl=app.config['USER_CACHE_TTL'])
+    app.extensions['recent_posts'] = RecentPosts(ttl=app.config['RECENT_POSTS_TTL'])
+    app.extensions['post_slugs'] = PostSlugs()
+    app.extensions['hasher'] = PasswordHasher(rounds=app.config['BCRYPT_ROUNDS'],
+                                              workers=app.config['BCRYPT_WORKERS'],
+                                              max_per_client=app.config['BCRYPT_MAX_PER_CLIENT'],
+                                              timeout=app.config['BCRYPT_TIMEOUT'],
+                                              max_pending=app.config['BCRYPT_MAX_PENDING'])
+    app.extensions['search_limiter'] = RateLimiter(rate=app.config['SEARCH_RATE'], burst=app.config['SEARCH_BURST'])
+    app.extensions['search_results'] = ResultCache(size=app.config['SEARCH_CACHE_SIZE'],
+                                                   ttl=app.config['SEARCH_CACHE_TTL'])
+    app.extensions['compressor'] = Compressor(gzip_level=app.config['COMPRESSION_GZIP_LEVEL'],
+                                              brotli_quality=app.config['COMPRESSION_BROTLI_QUALITY'],
+                                              min_size=app.config['COMPRESSION_MIN_SIZE'],
+                                              cache_size=app.config['COMPRESSION_CACHE_SIZE'])
+
+    app.extensions['asset_manifest'] = assets.Manifest(app.static_folder)
+
+    routes.register(app)
+
+    app.extensions['profiler'] = Profiler(enabled=app.config['PROFILE_ENABLED'],
+                                          folder=app.config['PROFILE_FOLDER'],
+                                          interval=app.config['PROFILE_SAMPLE_INTERVAL'],
+                                          deterministic=app.config['PROFILE_DETERMINISTIC'],
+                                          keep=app.config['PROFILE_KEEP'])
+    app.extensions['profiler'].wrap_views(app, allowed=reader_is_admin)
+    return app
+
+# The state create_app gave the current app
+def recent_posts():
+    return current_app.extensions['recent_posts']
+
+def user_cache():
+    return current_app.extensions['user_cache']
+
+def post_slugs():
+    return current_app.extensions['post_slugs']
+
+def search_results():
+    return current_app.extensions['search_results']
+
+def search_limiter():
+    return current_app.extensions['search_limiter']
+
+def hasher():
+    return current_app.extensions['hasher']
+
+def compressor():
+    return current_app.extensions['compressor']
+
+def profiler():
+    return current_app.extensions['profiler']
+
+# gunicorn loads the app once in its master process and forks the workers from it (see gunicorn.conf.py). Whatever
+# gets loaded here is shared by all workers copy-on-write instead of being loaded by each of them.
+def warm_up(app):
+    assets.precompile_templates(app.jinja_env, log=lambda message: None)
+    render.render_markdown("Warm *up*\n\n```python\nimport bcrypt\n```\n")  # Markdown, its extensions and Pygments
+    import bcrypt
+    load_brotli()
+    app.extensions['asset_manifest'].reload()
+
+    gc.collect()
+    if hasattr(gc, 'freeze'):  # Python 3.7+: keeps the collector from writing to (and so copying) the shared objects
+        gc.freeze()
+
+# Forked workers must not share the master's database connection or the threads and entries of its caches
+def before_fork(app):
+    if not app.extensions['database'].is_closed():
+        app.extensions['database'].close()
+
+def after_fork(app):
+    app.extensions['hasher'].reset()
+    for name in ('user_cache', 'recent_posts', 'post_slugs', 'search_results', 'search_limiter', 'compressor'):
+        app.extensions[name].clear()
+
+
+# Rendered pages, the feed and json answers go out brotli or gzip compressed, see compression.py
+@routes.after_request
+def compress_response(response):
+    return compressor().compress_response(response)
 
 
 ### Initialize database ###
 
 # @app.before_request
 # def before_request():
-#     postgres_db.connect()
+#     database.connect()
 #
 # @app.after_request
 # def after_request(response):
-#     postgres_db.close()
+#     database.close()
 #     return response
 
-# Before first request: Create database tables. Make sure to have the postgres extension 'hstore' installed on the db.
-@app.before_first_request
+# Create the database tables and indexes. Run this on every deploy (the release phase in the Procfile does), web
+# processes don't touch the schema. Make sure to have the postgres extension 'hstore' installed on the db.
+@routes.cli.command('initdb')
 def setup_database():
     # Create data tables
-    postgres_db.create_tables([User, Post, PostUser, Tag, PostTag, Settings], safe=True)
-
-    # Adding gin index to Post.content and Tag.name for faster search
-    language = 'english'
+    database.create_tables([User, Post, PostUser, Tag, PostTag, Settings, Job, PostMonth], safe=True)
+    util.add_missing_columns(database.current(), [Settings, Post])
+
+    # Only one pending job per kind and key, the worker takes the oldest due job first
+    database.execute_sql("CREATE UNIQUE INDEX IF NOT EXISTS job_pending_kind_key ON job (kind, key) "
+                            "WHERE status = 'pending'")
+    database.execute_sql("CREATE INDEX IF NOT EXISTS job_status_run_at ON job (status, run_at)")
+
+    # Posts are looked up by their slug. Tables from before slugs were unique may still hold duplicates.
+    util.deduplicate_slugs()
+    database.execute_sql("CREATE UNIQUE INDEX IF NOT EXISTS post_slug ON post (slug)")
+
+    # Posts published before first_published_at existed keep their slugs
+    Post.update(first_published_at=Post.created_at)\
+        .where(Post.published & Post.first_published_at.is_null())\
+        .execute()
+
+    # The public listings (see queries.py) only ever read published posts, newest first
+    database.execute_sql("CREATE INDEX IF NOT EXISTS post_published_created_at ON post (created_at DESC) "
+                            "WHERE published")
+    # Admins see the drafts in the date archive too
+    database.execute_sql("CREATE INDEX IF NOT EXISTS post_created_at ON post (created_at)")
+    queries.rebuild_post_months()
+
+    if uses_sqlite():
+        # SQLite searches a separate full text index of the posts, filled from the existing ones
+        database.create_tables([PostIndex], safe=True)
+        queries.update_search_index([post.id for post in Post.select(Post.id)])
+    else:
+        # Adding gin index to Post.content and Tag.name for faster search
+        language = 'english'
 
-    Post.add_index(
-        SQL("CREATE INDEX post_full_text_search ON post USING GIN(to_tsvector('" + language + '\',content))'))
-    Tag.add_index(
-        SQL("CREATE INDEX tag_full_text_search ON tag USING GIN(to_tsvector('" + language + '\', name))'))
+        database.execute_sql("CREATE INDEX IF NOT EXISTS post_full_text_search ON post "
+                                "USING GIN(to_tsvector('" + language + "', content))")
+        database.execute_sql("CREATE INDEX IF NOT EXISTS tag_full_text_search ON tag "
+                                "USING GIN(to_tsvector('" + language + "', name))")
+    click.echo("Database is set up")
 
 
 ### Initialize authentification ###
 auth = LoginManager()
-auth.init_app(app)
 
 # Define auth login behaviour
 auth.login_view = "login"
@@ -72,36 +215,36 @@ def admin_required(f):
         return f(*args, **kwargs)
     return wrapper
 
-# Wrapper for getting a user by id
+# Admins see drafts in the listings as well, everybody else only published posts
+def reader_is_admin():
+    return current_user.is_authenticated and current_user.admin
+
+# Wrapper for getting a user by id. Runs on every request of a logged-in user, hence the cache.
 @auth.user_loader # Callback for retrieving a user object.
 def user_loader(uid):
-    user = None
-    try:
-        user = User.get(User.id == uid)
-    except User.DoesNotExist:
-        pass
-    return user
+    return user_cache().get(uid)
 
 
 ### Jinja Templates ###
 
-# Make settings available to all jinja templates
-@app.context_processor
+# Make settings and the most recent posts available to all jinja templates.
+# The recent posts come from an in-process ring buffer, so they cost no extra query.
+@routes.context_processor
 def settings_context_processor():
-    settings = model_to_dict(util.get_current_settings())
-    values = {'settings': settings}
+    settings = util.get_current_settings()
+    values = {'settings': model_to_dict(settings),
+              'recent_posts': recent_posts().get(settings.number_of_recent_posts),
+              'post_months': queries.post_months}
     return values
 
 # Create a jinja filter that can handle markdown
-@app.template_filter('Markdown')
+@routes.template_filter('Markdown')
 def filter_markdown(raw_markdown):
-    return jinja2.Markup(markdown.markdown(raw_markdown, extensions=[GithubMarkdown()]))
+    return jinja2.Markup(render.render_markdown(raw_markdown))
 
-app.jinja_env.trim_blocks = True
-app.jinja_env.lstrip_blocks = True
 
 # Uncomment this if you want the most used tags available to all jinja templates as a variable.
-# @app.context_processor
+# @routes.context_processor
 # def top_tags_context_processor():
 #     values = {}
 #
@@ -118,11 +261,85 @@ app.jinja_env.lstrip_blocks = True
 #     values['top_tags'] = list(sorted_tags)[0:10]
 #     return values
 
-# Uncomment this if you want the most recents posts available on all sites as a jinja variable.
-# @app.context_processor
-# def recent_post_context_processor():
-#     settings = util.get_current_settings()
-#     return {'recent_posts': Post.select().order_by(Post.created_at.desc()).limit(settings.number_of_recent_posts)}
+
+### Static assets ###
+
+# Once 'flask assets' has been run, static files are served under fingerprinted names out of static/dist
+def asset_manifest():
+    return current_app.extensions['asset_manifest']
+
+@routes.template_global('url_for')
+def asset_url_for(endpoint, **values):
+    if endpoint == 'static':
+        fingerprinted = asset_manifest().get(values.get('filename'))
+        if fingerprinted:
+            values['filename'] = fingerprinted
+            return url_for('static_dist', **values)
+    return url_for(endpoint, **values)
+
+# Each page type loads one stylesheet and one script bundle. Without a build the bundled files get loaded one by one.
+@routes.template_global()
+def asset_bundle_urls(name):
+    filenames, built = asset_manifest().bundle(name)
+    if built:
+        return [url_for('static_dist', filename=filename) for filename in filenames]
+    return [asset_url_for('static', filename=filename) for filename in filenames]
+
+@routes.template_global()
+def critical_css(name):
+    return jinja2.Markup(asset_manifest().read(assets.CRITICAL_DIR + '/' + name))
+
+@routes.route('/static/dist/<path:filename>')
+def static_dist(filename):
+    return assets.send_asset(os.path.join(current_app.static_folder, assets.DIST_DIR), filename)
+
+# Build the fingerprinted and precompressed assets. Run this on every deploy.
+@routes.cli.command('assets')
+def build_assets():
+    assets.build(current_app.static_folder,
+                 scss_folder=os.path.join(current_app.root_path, 'assets', 'scss'),
+                 template_folder=os.path.join(current_app.root_path, current_app.template_folder),
+                 safelist=current_app.config['ASSET_PRUNE_SAFELIST'],
+                 pygments_style=current_app.config['PYGMENTS_STYLE'],
+                 log=click.echo)
+    asset_manifest().reload()
+
+# Compile all templates into the bytecode cache. Run this on every deploy, after 'flask assets'.
+@routes.cli.command('precompile')
+def precompile_templates():
+    assets.precompile_templates(current_app.jinja_env, log=click.echo)
+
+# Render the public pages into static files, see export.py
+@routes.cli.command('export')
+@click.option('--output', default=None, help="Folder to export into, defaults to EXPORT_FOLDER.")
+@click.option('--processes', default=None, type=int, help="Number of rendering processes.")
+@click.option('--incremental', is_flag=True, help="Only render the pages that changed since the last export.")
+def export_site(output, processes, incremental):
+    output = output or current_app.config['EXPORT_FOLDER']
+    if not output:
+        raise click.UsageError("Pass --output or set EXPORT_FOLDER.")
+    export.export(current_app._get_current_object(), output,
+                  processes=processes or current_app.config['EXPORT_PROCESSES'],
+                  incremental=incremental,
+                  base_url=current_app.config['EXPORT_BASE_URL'],
+                  log=click.echo)
+
+# Bring the sitemaps up to date, see sitemap.py
+@routes.cli.command('sitemap')
+def update_sitemap():
+    if not current_app.config['SITEMAP_BASE_URL']:
+        raise click.UsageError("Set SITEMAP_BASE_URL (TRUNKS_SITEMAP_BASE_URL) to the address of the blog.")
+    sitemap.update(current_app._get_current_object(), current_app.config['SITEMAP_FOLDER'],
+                   base_url=current_app.config['SITEMAP_BASE_URL'],
+                   log=click.echo)
+
+# Run the background jobs, see Procfile
+@routes.cli.command('worker')
+def run_worker():
+    jobs.work(poll_interval=current_app.config['JOB_POLL_INTERVAL'],
+              timeout=current_app.config['JOB_TIMEOUT'],
+              keep_days=current_app.config['JOB_KEEP_DAYS'],
+              log=click.echo)
 
 
 
@@ -133,25 +350,27 @@ app.jinja_env.lstrip_blocks = True
 
 # Create a standard admin user. Testing only!!!
 
-if app.testing == True:
-    @app.route('/init')
-    def init_user():
-        try:
-            User.create(name="admin", password=bcrypt.hashpw(b"password", bcrypt.gensalt()), admin=True)
-            flash("Created user: admin", 'success')
+@routes.route('/init')
+def init_user():
+    if not current_app.testing:
+        abort(404)
 
-        except peewee.IntegrityError:
-            flash("User admin already exists", 'danger')
+    try:
+        User.create(name="admin", password=hasher().hash("password"), admin=True)
+        flash("Created user: admin", 'success')
 
-        if current_user.is_authenticated:
-            return redirect(url_for('admin_user_list'))
-        else:
-            return redirect(url_for('login'))
+    except peewee.IntegrityError:
+        flash("User admin already exists", 'danger')
+
+    if current_user.is_authenticated:
+        return redirect(url_for('admin_user_list'))
+    else:
+        return redirect(url_for('login'))
 
 ### Login / Logout ###
 
 # Login view
-@app.route('/login')
+@routes.route('/login')
 def login():
     if current_user.is_authenticated:
         if current_user.admin:
@@ -162,7 +381,7 @@ def login():
         return render_template('login.html')
 
 # Login
-@app.route('/login/go', methods=["POST"])
+@routes.route('/login/go', methods=["POST"])
 def do_login():
     username = request.form.get("username", False)
     password = request.form.get("password", False)
@@ -170,7 +389,11 @@ def do_login():
     if username and password:
         try:
             u = User.get(User.name == username)
-            if bcrypt.hashpw(password.encode(), u.password.encode()) == u.password.encode():
+            if hasher().check(password, u.password, util.client_address()):
+                if hasher().needs_rehash(u.password):  # BCRYPT_ROUNDS changed since the password was set
+                    u.password = hasher().hash(password, util.client_address())
+                    u.save()
+                    user_cache().invalidate(u.id)
                 login_user(u)
                 requested_page = request.args.get('next')
                 default_page = url_for('admin_main') if u.admin else url_for('blog')
@@ -180,13 +403,15 @@ def do_login():
                 return redirect(url_for('login'))
         except User.DoesNotExist:
             flash("Username or password incorrect.", "danger")
+        except TooManyAttempts:
+            flash("Too many login attempts at once, please try again.", "danger")
     else:
         flash("Username and password required.", "danger")
 
     return redirect(url_for('login'))
 
 # Logout
-@app.route('/logout')
+@routes.route('/logout')
 def logout():
     logout_user()
     return redirect(url_for('index'))
@@ -195,80 +420,91 @@ def logout():
 ### Actual blog ###
 
 # Index url redirects
-@app.route('/index')
-@app.route('/')
+@routes.route('/index')
+@routes.route('/')
 def index():
     return redirect("blog")
 
 # Frontpage view
-@app.route('/blog/archive/<int:page>')
-@app.route('/blog/archive', defaults={'page': 1})
-@app.route('/blog', defaults={'page': 1})
+@routes.route('/blog/archive/<int:page>')
+@routes.route('/blog/archive', defaults={'page': 1})
+@routes.route('/blog', defaults={'page': 1})
 def blog(page):
     settings = util.get_current_settings()
 
-    posts_with_tags = []
-    if current_user.is_authenticated:
-        if current_user.admin:
-            posts = Post.select().order_by(Post.created_at.desc())
-    else:
-        posts = Post.select().where(Post.published).order_by(Post.created_at.desc())
-
-    number_of_posts = Post.select().count()
-    posts = posts.paginate(page, settings.posts_per_page)
-
-    for post in posts:
-        tags = Tag.select().join(PostTag).where(PostTag.post == post).order_by(Tag.name)
-        posts_with_tags.append([post, tags])
+    posts = queries.visible_posts(reader_is_admin())
 
+    number_of_posts = posts.count()
     pages = Pagination(page, settings.posts_per_page, number_of_posts, 7)
+    if pages.out_of_range:
+        abort(404)  # Before querying the posts of a page that cannot have any
+
+    posts_with_tags = queries.with_tags(posts.paginate(page, settings.posts_per_page))
 
     if not number_of_posts == 0:
-        return render_template('blog_list.html', posts_with_tags=posts_with_tags, pages=pages)
+        return render_template('blog.html', posts_with_tags=posts_with_tags, pages=pages)
     else:
         notice = "No posts yet  :/"
         return render_template('notice.html', notice=notice)
 
+# Date archive: the posts of a year or a month, found by a range scan instead of paging through the whole blog
+@routes.route('/blog/<int:year>', defaults={'month': None, 'page': 1})
+@routes.route('/blog/<int:year>/page/<int:page>', defaults={'month': None})
+@routes.route('/blog/<int:year>/<int:month>', defaults={'page': 1})
+@routes.route('/blog/<int:year>/<int:month>/page/<int:page>')
+def archive_view(year, month, page):
+    if not datetime.MINYEAR <= year < datetime.MAXYEAR or (month is not None and not 1 <= month <= 12):
+        abort(404)
+    settings = util.get_current_settings()
+
+    posts = queries.posts_in_period(year, month, reader_is_admin())
+
+    number_of_posts = posts.count()
+    pages = Pagination(page, settings.posts_per_page, number_of_posts, 7)
+    if number_of_posts == 0 or pages.out_of_range:
+        abort(404)
+
+    posts_with_tags = queries.with_tags(posts.paginate(page, settings.posts_per_page))
+    return render_template('archive_view.html', posts_with_tags=posts_with_tags, pages=pages, year=year, month=month,
+                           period_start=datetime.date(year, month or 1, 1))
+
 # Post view
-@app.route('/post/<int:pid>')
-@app.route('/post/<int:pid>/<slug>')
+@routes.route('/recipes/<slug>')
+def post(slug):
+    post = queries.visible_post(slug, reader_is_admin())
+    if post is None: # Drafts don't exist for readers
+        abort(404)
 
-def post(pid, slug=None):
-    post = None
-    try:
-        post = Post.get(Post.id == pid)
-        tags = Tag.select().join(PostTag).where(PostTag.post == post).order_by(Tag.name)
-        user = User.select().join(PostUser, peewee.JOIN.LEFT_OUTER).where(PostUser.post == post)
-        if user:
-            user = user[0]
-    except Post.DoesNotExist: # Since a non-existent post id leads to a query exception, the appropriate response is the
-        abort(404)            # 404 error, not a notice
-    return render_template('post_view.html', post=post, tags=tags, user=user)
+    tags = Tag.select().join(PostTag).where(PostTag.post == post).order_by(Tag.name)
+    user = User.select().join(PostUser, peewee.JOIN.LEFT_OUTER).where(PostUser.post == post)
+    if user:
+        user = user[0]
+    content_html = render.post_html(post)
+    return render_template('post_view.html', post=post, content_html=content_html, tags=tags, user=user)
+
+# Old post urls (with any or no slug) permanently redirect to the canonical one
+@routes.route('/post/<int:pid>')
+@routes.route('/post/<int:pid>/<path:slug>')
+def post_by_id(pid, slug=None):
+    canonical_slug = post_slugs().get(pid, reader_is_admin())  # The slug of a draft would give its title away
+    if canonical_slug is None:
+        abort(404)
+    return redirect(url_for('post', slug=canonical_slug), code=301)
 
 # Blog view of all posts with a certain tag
-@app.route('/tag/<tag_name>', defaults={'page': 1})
-@app.route('/tag/<tag_name>/<int:page>')
+@routes.route('/tag/<tag_name>', defaults={'page': 1})
+@routes.route('/tag/<tag_name>/<int:page>')
 def tag_view(tag_name, page):
     settings = util.get_current_settings()
 
-    if current_user.is_authenticated:
-        if current_user.admin:
-            matches = Post.select().join(PostTag).join(Tag)\
-                .where(Tag.name == tag_name).order_by(Post.created_at.desc())
-    else:
-        matches = Post.select().where(Post.published).join(PostTag).join(Tag)\
-            .where(Tag.name == tag_name).order_by(Post.created_at.desc())
+    matches = queries.posts_with_tag(tag_name, reader_is_admin())
 
     number_of_matches = matches.count()
-    matches = matches.paginate(page, settings.posts_per_page)
-
-    matches_with_tags = []
-    for match in matches:
-        tags = Tag.select().join(PostTag)\
-            .where(PostTag.post == match).order_by(Tag.name)
-        matches_with_tags.append([match, tags])
-
     pages = Pagination(page, settings.posts_per_page, number_of_matches, 7)
+    if pages.out_of_range:
+        abort(404)
+
+    matches_with_tags = queries.with_tags(matches.paginate(page, settings.posts_per_page))
 
     if not number_of_matches == 0:
         return render_template('tag_view.html', posts_with_tags=matches_with_tags, pages=pages, tag_name=tag_name)
@@ -277,29 +513,19 @@ def tag_view(tag_name, page):
         return render_template('notice.html', notice=notice )
 
 # Blog view of all posts by a certain user
-@app.route('/user/<user_name>', defaults={'page': 1})
-@app.route('/user/<user_name>/<int:page>')
+@routes.route('/user/<user_name>', defaults={'page': 1})
+@routes.route('/user/<user_name>/<int:page>')
 def user_view(user_name, page):
     settings = util.get_current_settings()
 
-    if current_user.is_authenticated:
-        if current_user.admin:
-            matches = Post.select().join(PostUser).join(User)\
-                .where(User.name == user_name).order_by(Post.created_at.desc())
-    else:
-        matches = Post.select().where(Post.published).join(PostUser).join(User)\
-            .where(User.name == user_name).order_by(Post.created_at.desc())
+    matches = queries.posts_by_user(user_name, reader_is_admin())
 
     number_of_matches = matches.count()
-    matches = matches.paginate(page, settings.posts_per_page)
-
-    matches_with_tags = []
-    for match in matches:
-        tags = Tag.select().join(PostTag)\
-            .where(PostTag.post == match).order_by(Tag.name)
-        matches_with_tags.append([match, tags])
-
     pages = Pagination(page, settings.posts_per_page, number_of_matches, 7)
+    if pages.out_of_range:
+        abort(404)
+
+    matches_with_tags = queries.with_tags(matches.paginate(page, settings.posts_per_page))
 
     if not number_of_matches == 0:
         return render_template('user_view.html', posts_with_tags=matches_with_tags, pages=pages, user_name=user_name)
@@ -307,62 +533,57 @@ def user_view(user_name, page):
         notice = "No posts by user " + '"' + str(user_name) + '"!'
         return render_template('notice.html', notice=notice )
 
+# Atom feed of the latest published posts
+@routes.route('/feed.xml')
+def feed():
+    posts = queries.visible_posts(False).limit(20)
+    updated = max([post.updated_at for post in posts] or [datetime.datetime.now()])
+    return current_app.response_class(render_template('feed.xml', posts=posts, updated=updated),
+                              mimetype='application/atom+xml')
+
+# Sitemap index for crawlers, pointing to the sitemaps below. They are files on disk, updated by the worker after
+# every change to the posts (and by the first request after SITEMAP_MAX_AGE, if the worker can't reach this disk).
+# Without SITEMAP_BASE_URL they are never written from here: the Host header of one request would end up in the urls
+# every crawler gets.
+@routes.route('/sitemap.xml')
+def sitemap_index():
+    folder = current_app.config['SITEMAP_FOLDER']
+    base_url = current_app.config['SITEMAP_BASE_URL']
+    if base_url and sitemap.is_stale(folder, current_app.config['SITEMAP_MAX_AGE']):
+        sitemap.update(current_app._get_current_object(), folder, base_url=base_url, log=lambda message: None)
+    return send_from_directory(folder, sitemap.INDEX_NAME, mimetype='application/xml')
+
+@routes.route('/sitemaps/<name>')
+def sitemap_file(name):
+    if name == sitemap.INDEX_NAME or not name.startswith('sitemap-'):
+        abort(404)
+    return send_from_directory(current_app.config['SITEMAP_FOLDER'], name, mimetype='application/xml')
+
 
 # Search
-@app.route('/search', methods=["POST"])
+@routes.route('/search', methods=["POST"])
 def search():
+    # Only redirects, search_view does (and rate limits) the searching
     query = request.form.get('navbar-search-input')
     return redirect(url_for('search_view', query=query))
 
 # Blog view of all search results (posts appear only once, despite several matches in title, content and tags)
-@app.route('/search/<query>', defaults={'page': 1})
-@app.route('/search/<query>/<int:page>')
+@routes.route('/search/<query>', defaults={'page': 1})
+@routes.route('/search/<query>/<int:page>')
 def search_view(query, page):
+    limit_search_rate()
     settings = util.get_current_settings()
 
-    query_str = "\'" + query + "\'" # the quotation marks are absolutely necessary for a pg tsquery with multiple words
-
-    if current_user.is_authenticated:
-        if current_user.admin:
-            posts_matched_content = Post.select()\
-                .where((Match(Post.content, query_str) == True))
-            posts_matched_title = Post.select()\
-                .where((Match(Post.title, query_str) == True)
-                       & (Match(Post.content, query_str) == False))
-            posts_matched_tag = Post.select().join(PostTag).join(Tag)\
-                .where((Match(Tag.name, query_str) == True)
-                       & (Match(Post.title, query_str) == False)
-                       & (Match(Post.content, query_str) == False))
-
-
-
-    else:
-        posts_matched_content = Post.select()\
-                .where((Post.published == True)
-                       & (Match(Post.content, query_str) == True))
-        posts_matched_title = Post.select()\
-                .where((Post.published == True)
-                       & (Match(Post.title, query_str) == True)
-                       & (Match(Post.content, query_str) == False))
-        posts_matched_tag = Post.select().join(PostTag).join(Tag) \
-                .where((Post.published == True)
-                       & (Match(Tag.name, query_str) == True)
-                       & (Match(Post.title, query_str) == False)
-                       & (Match(Post.content, query_str) == False))
-
-    posts_matched = posts_matched_content + posts_matched_title + posts_matched_tag
-
-    number_of_matched_posts = posts_matched.count()
-
-    posts_matched = posts_matched.paginate(page, settings.posts_per_page)
-
-    posts_with_tags = []
-    for post in posts_matched:
-        tags = Tag.select().join(PostTag)\
-            .where(PostTag.post == post).order_by(Tag.name)
-        posts_with_tags.append([post, tags])
+    # Identical searches share one result, computed once even if they arrive at the same time. Saving a post drops
+    # all results.
+    admin = reader_is_admin()
+    number_of_matched_posts, posts_with_tags = search_results().get(
+        (admin, query, page, settings.posts_per_page),
+        lambda: find_posts(query, page, settings.posts_per_page, admin))
 
     pages = Pagination(page, settings.posts_per_page, number_of_matched_posts, 7)
+    if pages.out_of_range:
+        abort(404)
 
     if not number_of_matched_posts == 0:
         return render_template('search_view.html',
@@ -372,22 +593,51 @@ def search_view(query, page):
                                current=search_view)
 
     else:
+        query_str = "\'" + query + "\'"
         notice = "No search results for " + str(query_str) + " !"
         return render_template('notice.html', notice=notice)
 
+# Number of posts matching the query and the posts (with their tags) of the requested page
+def find_posts(query, page, per_page, admin):
+    posts_matched = queries.search_posts(query, admin)
+
+    number_of_matched_posts = posts_matched.count()
+    if Pagination(page, per_page, number_of_matched_posts, 7).out_of_range:
+        return number_of_matched_posts, []
+
+    return number_of_matched_posts, queries.with_tags(posts_matched.paginate(page, per_page))
+
+# Searching is the most expensive public page, every client gets SEARCH_BURST searches at once and SEARCH_RATE per
+# second after that. Only search_view takes a token, so a search from the navbar costs one.
+def limit_search_rate():
+    if not search_limiter().allow(util.client_address()):
+        abort(429)
 
-# Preview a post below the compose view
-@app.route('/admin/preview', methods=["POST"])
+
+# Preview a post below the compose view. The editor sends only the blocks of the content it has no html for yet and
+# gets their html back in the same order. Whole documents (postContent_markdown) still work as well.
+@routes.route('/admin/preview', methods=["POST"])
 @login_required
 @admin_required
 def preview():
     data = request.get_json()
-    html = markdown.markdown(data['postContent_markdown'], extensions=[GithubMarkdown()])
+    if not isinstance(data, dict):
+        abort(400)
+
     date_time = datetime.datetime.now().strftime("%B %d, %Y")
-    return jsonify(html=html, date_time=date_time)
+    if 'blocks' in data:
+        blocks = data['blocks']
+        if not isinstance(blocks, list) or len(blocks) > current_app.config['PREVIEW_MAX_BLOCKS'] \
+                or not all(isinstance(block, str) for block in blocks):
+            abort(400)
+        return jsonify(blocks=render.render_blocks(blocks), date_time=date_time)
+    elif isinstance(data.get('postContent_markdown'), str):
+        return jsonify(html=render.render_preview(data['postContent_markdown']), date_time=date_time)
+    else:
+        abort(400)
 
 # View to create a post
-@app.route('/admin/posts/compose')
+@routes.route('/admin/posts/compose')
 @login_required
 @admin_required
 def compose():
@@ -395,7 +645,7 @@ def compose():
     return render_template('compose.html', editing=False, all_tags=all_tags)
 
 # Edit a post via the compose view
-@app.route('/admin/posts/edit/<pid>')
+@routes.route('/admin/posts/edit/<pid>')
 @login_required
 @admin_required
 def admin_edit_post(pid):
@@ -417,14 +667,13 @@ def admin_edit_post(pid):
                            all_tags=all_tags)
 
 # Save a created or edited post
-@app.route('/admin/posts/save', methods=["POST"])
+@routes.route('/admin/posts/save', methods=["POST"])
 @login_required
 @admin_required
 def admin_save_post():
 
     edit_id = request.form.get('post-edit-id')
     title = request.form.get('post-form-title')
-    slug = util.slugify(title)
     content = request.form.get('post-form-content')
     description = request.form.get('post-form-description')
     tags = request.form.get('post-form-tags')
@@ -437,13 +686,19 @@ def admin_save_post():
         if edit_id:
             try:
                 post = Post.get(Post.id == edit_id)
+                if post.first_published_at is None:
+                    # Once published the url stays, links to it are out there (even after unpublishing it again)
+                    post.slug = util.unique_slug(title, post.id)
+                if publish and post.first_published_at is None:
+                    post.first_published_at = datetime.datetime.now()
                 post.title = title
                 post.content = content
-                post.slug = slug
+                post.content_html = None  # Rendered by the post_saved job
                 post.description = description
                 post.updated_at = datetime.datetime.now()
                 post.published = publish
                 post.save()
+                post_slugs().set(post.id, post.slug, post.published)
 
                 if tags is not None:
                     for tag_name in tags:
@@ -455,6 +710,18 @@ def admin_save_post():
                     if not old_tag in tags:
                         PostTag.get(PostTag.post == post, PostTag.tag == old_tag).delete_instance()
 
+                if publish:
+                    recent_posts().publish(post)
+                else:
+                    recent_posts().discard(post.id)
+
+                jobs.enqueue('post_saved', post.id)
+                if current_app.config['EXPORT_FOLDER']:
+                    jobs.enqueue('export', 'site')
+                jobs.enqueue('sitemap', 'site')
+                queries.update_search_index([post.id])
+                queries.update_post_months([post.created_at])
+                search_results().clear()
                 flash("Post edited!", "success")
 
             except Post.DoesNotExist:
@@ -464,10 +731,12 @@ def admin_save_post():
             try:
                 post = Post(title=title,
                             content=content,
-                            slug=slug,
+                            slug=util.unique_slug(title),
                             description=description,
-                            published=publish)
+                            published=publish,
+                            first_published_at=datetime.datetime.now() if publish else None)
                 post.save()
+                post_slugs().set(post.id, post.slug, post.published)
                 postuser = PostUser(post=post, user=current_user.id)
                 postuser.save()
 
@@ -476,7 +745,16 @@ def admin_save_post():
                         tag, _ = Tag.get_or_create(name=tag_name)
                         posttag, _ = PostTag.get_or_create(post=post, tag=tag)
 
+                jobs.enqueue('post_saved', post.id)
+                if current_app.config['EXPORT_FOLDER']:
+                    jobs.enqueue('export', 'site')
+                jobs.enqueue('sitemap', 'site')
+                queries.update_search_index([post.id])
+                queries.update_post_months([post.created_at])
+                search_results().clear()
+
                 if publish:
+                    recent_posts().publish(post)
                     flash("Post published!", "success")
                 elif not publish:
                     flash("Post saved as draft!", "success")
@@ -490,14 +768,14 @@ def admin_save_post():
     return redirect(url_for('admin_post_list'))
 
 # 'Index' view of the admin part of the app
-@app.route('/admin')
+@routes.route('/admin')
 @login_required
 @admin_required
 def admin_main():
     return redirect(url_for('admin_post_list'))
 
 # Table view of all posts
-@app.route('/admin/posts')
+@routes.route('/admin/posts')
 @login_required
 @admin_required
 def admin_post_list():
@@ -538,7 +816,7 @@ def admin_post_list():
 
 
 # Delete a post
-@app.route('/admin/posts/delete', methods=["POST"])
+@routes.route('/admin/posts/delete', methods=["POST"])
 @login_required
 @admin_required
 def admin_post_delete():
@@ -559,6 +837,14 @@ def admin_post_delete():
             postuser_to_delete = PostUser.select().where(PostUser.post == post_to_delete)[0]
             postuser_to_delete.delete_instance()
             post_to_delete.delete_instance()
+            recent_posts().discard(post_to_delete.id)
+            post_slugs().discard(post_to_delete.id)
+            queries.update_search_index([post_to_delete.id])
+            queries.update_post_months([post_to_delete.created_at])
+            search_results().clear()
+            if current_app.config['EXPORT_FOLDER']:
+                jobs.enqueue('export', 'site')
+            jobs.enqueue('sitemap', 'site')
 
             if request.form.get('was_edit', None) and request.form.get('was_edit', None) == 'true':
                 flash('Deleted post ' + str(post_to_delete.id) + ' !', "success")
@@ -578,7 +864,7 @@ def admin_post_delete():
 
 
 # Table view of all tags - number of tagged posts with link to blog view of these posts
-@app.route('/admin/tags')
+@routes.route('/admin/tags')
 @login_required
 @admin_required
 def admin_tag_list():
@@ -593,7 +879,7 @@ def admin_tag_list():
     return render_template('tag_list.html', tags=tags_with_post_counts)
 
 
-@app.route('/admin/tags/create')
+@routes.route('/admin/tags/create')
 @login_required
 @admin_required
 def admin_tag_create():
@@ -601,7 +887,7 @@ def admin_tag_create():
     return render_template('tag_edit.html', editing=False, tags=False, all_tags = all_tags)
 
 
-@app.route('/admin/tags/edit/<uid>')
+@routes.route('/admin/tags/edit/<uid>')
 @login_required
 @admin_required
 def admin_tag_edit(uid):
@@ -613,7 +899,7 @@ def admin_tag_edit(uid):
     return render_template('tag_edit.html', editing=True, tag_to_edit=tag_to_edit, all_tags = all_tags )
 
 
-@app.route('/admin/tags/save', methods=["POST"])
+@routes.route('/admin/tags/save', methods=["POST"])
 @login_required
 @admin_required
 def admin_tag_save():
@@ -628,6 +914,12 @@ def admin_tag_save():
                 tag_to_edit = Tag.get(Tag.id == edit_id)
                 tag_to_edit.name = tags[0]
                 tag_to_edit.save()
+                queries.update_search_index([post_tag.post_id for post_tag in
+                                             PostTag.select(PostTag.post).where(PostTag.tag == tag_to_edit)])
+                search_results().clear()
+                if current_app.config['EXPORT_FOLDER']:
+                    jobs.enqueue('export', 'site')
+                jobs.enqueue('sitemap', 'site')
                 flash("Tag edited", "success")
 
             except Tag.DoesNotExist:
@@ -653,7 +945,7 @@ def admin_tag_save():
     return redirect(url_for('admin_tag_list'))
 
 
-@app.route('/admin/tags/delete', methods=["POST"])
+@routes.route('/admin/tags/delete', methods=["POST"])
 @login_required
 @admin_required
 def admin_tag_delete():
@@ -669,9 +961,16 @@ def admin_tag_delete():
         try:
             tag_to_delete = Tag.get(Tag.id == id_to_delete)
             posttags_to_delete = PostTag.select().where(PostTag.tag == tag_to_delete)
+            tagged_post_ids = []
             for posttag in posttags_to_delete:
+                tagged_post_ids.append(posttag.post_id)
                 posttag.delete_instance()
             tag_to_delete.delete_instance()
+            queries.update_search_index(tagged_post_ids)
+            search_results().clear()
+            if current_app.config['EXPORT_FOLDER']:
+                jobs.enqueue('export', 'site')
+            jobs.enqueue('sitemap', 'site')
 
         except Tag.DoesNotExist:
             status['ok'] = False
@@ -679,7 +978,7 @@ def admin_tag_delete():
     return json.dumps(status)
 
 
-@app.route('/admin/users')
+@routes.route('/admin/users')
 @login_required
 @admin_required
 def admin_user_list():
@@ -692,14 +991,14 @@ def admin_user_list():
     return render_template('user_list.html', users_with_post_counts=users_with_post_counts)
 
 
-@app.route('/admin/users/create')
+@routes.route('/admin/users/create')
 @login_required
 @admin_required
 def admin_user_create():
     return render_template('user_edit.html', editing=False, selfediting=False)
 
 
-@app.route('/admin/users/edit/<uid>')
+@routes.route('/admin/users/edit/<uid>')
 @login_required
 @admin_required
 def user_edit(uid):
@@ -714,7 +1013,7 @@ def user_edit(uid):
         return render_template('user_edit.html', editing=True, user=user_to_edit, selfediting=False)
 
 
-@app.route('/profile')
+@routes.route('/profile')
 @login_required
 def profile_user_edit():
     current_user_id = current_user.id
@@ -732,21 +1031,26 @@ def user_save():
             try:
                 user_to_edit = User.get(User.id == edit_id)
 
-                hashed_pw = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
+                hashed_pw = hasher().hash(password, util.client_address())
                 user_to_edit.name = username
                 user_to_edit.password = hashed_pw
                 user_to_edit.admin = is_admin
 
                 user_to_edit.save()
+                user_cache().invalidate(user_to_edit.id)
                 flash("User edited", "success")
             except User.DoesNotExist:
                 abort(404)
+            except TooManyAttempts:
+                flash("Server busy, please try again.", "danger")
 
         else:
-
-            hashed_pw = bcrypt.hashpw(password.encode(), bcrypt.gensalt())
-            User.create(name=username, password=hashed_pw, admin=is_admin)
-            flash("User created!", "success")
+            try:
+                hashed_pw = hasher().hash(password, util.client_address())
+                User.create(name=username, password=hashed_pw, admin=is_admin)
+                flash("User created!", "success")
+            except TooManyAttempts:
+                flash("Server busy, please try again.", "danger")
 
     else:
         flash("Can't create user without name and password", "danger")
@@ -757,14 +1061,14 @@ def user_save():
         return redirect(url_for('blog'))
 
 
-@app.route('/admin/users/save', methods=["POST"])
+@routes.route('/admin/users/save', methods=["POST"])
 @login_required
 @admin_required
 def admin_user_save():
     return user_save()
 
 
-@app.route('/profile/save', methods=["POST"])
+@routes.route('/profile/save', methods=["POST"])
 @login_required
 def profile_user_save():
     if 'user-edit-id' not in request.form:
@@ -790,6 +1094,7 @@ def user_delete(uid):
             for postuser in postusers_to_delete:
                 postuser.delete_instance()
             user_to_delete.delete_instance()
+            user_cache().invalidate(user_to_delete.id)
 
         except User.DoesNotExist:
             flash("User does not exist, please look into the sql table", "danger")
@@ -801,7 +1106,7 @@ def user_delete(uid):
 
     return json.dumps(status)
 
-@app.route('/profile/delete', methods=["POST"])
+@routes.route('/profile/delete', methods=["POST"])
 @login_required
 def profile_user_delete():
 
@@ -817,7 +1122,7 @@ def profile_user_delete():
         abort(400)
 
 
-@app.route('/admin/users/delete', methods=["POST"])
+@routes.route('/admin/users/delete', methods=["POST"])
 @login_required
 @admin_required
 def admin_user_delete():
@@ -839,7 +1144,66 @@ def admin_user_delete():
         return user_delete(id_to_delete)
 
 
-@app.route('/admin/settings')
+# Status of the background jobs
+@routes.route('/admin/jobs')
+@login_required
+@admin_required
+def admin_job_list():
+    status_counts = Job.select(Job.status, fn.Count(Job.id).alias('count')).group_by(Job.status)
+    latest_jobs = Job.select().order_by(Job.updated_at.desc()).limit(100)
+    return render_template('job_list.html',
+                           status_counts={row.status: row.count for row in status_counts},
+                           jobs=latest_jobs)
+
+
+# Profiles of the requests admins asked to profile (with ?profile=1 or the cookie set below), see profiler.py
+@routes.route('/admin/profiles')
+@login_required
+@admin_required
+def admin_profile_list():
+    return render_template('profile_list.html',
+                           profiles=profiler().profiles(),
+                           profiling=profiler().requested())
+
+@routes.route('/admin/profiles/<name>')
+@login_required
+@admin_required
+def admin_profile_view(name):
+    profile = profiler().profile(name)
+    if profile is None:
+        abort(404)
+    boxes, samples = profiler().flame_graph(name)
+    return render_template('profile_view.html',
+                           profile=profile,
+                           boxes=boxes,
+                           samples=samples,
+                           depth=max([box[0] for box in boxes] or [0]) + 1,
+                           stats=profiler().stats_text(name))
+
+@routes.route('/admin/profiles/<name>/<any(collapsed, pstats):kind>')
+@login_required
+@admin_required
+def admin_profile_download(name, kind):
+    path = profiler().path(name, '.' + kind)
+    if path is None:
+        abort(404)
+    return send_from_directory(os.path.abspath(profiler().folder), os.path.basename(path), as_attachment=True,
+                               mimetype='text/plain' if kind == 'collapsed' else 'application/octet-stream')
+
+# Switches profiling of every request of this browser on or off
+@routes.route('/admin/profiles/opt-in', methods=["POST"])
+@login_required
+@admin_required
+def admin_profile_opt_in():
+    response = redirect(url_for('admin_profile_list'))
+    if request.form.get('profile') == 'on':
+        response.set_cookie(profiler().opt_in, '1', max_age=60 * 60, httponly=True)
+    else:
+        response.delete_cookie(profiler().opt_in)
+    return response
+
+
+@routes.route('/admin/settings')
 @login_required
 @admin_required
 def admin_settings():
@@ -848,10 +1212,18 @@ def admin_settings():
     return render_template("admin_settings.html", current_settings=current_settings)
 
 
-@app.route('/admin/settings/save', methods=["POST"])
+@routes.route('/admin/settings/save', methods=["POST"])
 @login_required
 @admin_required
 def admin_settings_save():
+    try:
+        number_of_recent_posts = int(request.form.get('number-of-recent-posts', ''))
+    except ValueError:
+        number_of_recent_posts = 0
+    if number_of_recent_posts < 1:
+        flash("The number of recent posts has to be a whole number of at least 1.", "danger")
+        return redirect(url_for('admin_settings'))
+
     try:
         current_settings = Settings.get(Settings.id == 1)
         current_settings.blog_title = request.form.get('blog-title')
@@ -861,6 +1233,7 @@ def admin_settings_save():
         current_settings.icon_2_icon_type = request.form.get('icon-2-icon-type')
         current_settings.posts_per_page = request.form.get('posts-per-page')
         current_settings.max_synopsis_chars = request.form.get('max-synopsis-chars')
+        current_settings.number_of_recent_posts = number_of_recent_posts
         current_settings.table_entries_per_page = request.form.get('table-entries-per-page')
         current_settings.save()
 
@@ -871,23 +1244,29 @@ def admin_settings_save():
     return redirect(url_for('admin_settings'))
 
 
-@app.errorhandler(404)
+@routes.errorhandler(404)
 def page_not_found(e):
     notice = """404: Nothing to see here!"""
     return render_template('notice.html', notice=notice), 404
 
-@app.errorhandler(400)
+@routes.errorhandler(400)
 def bad_request(e):
     notice = """400: Bad request!"""
     return render_template('notice.html', notice=notice), 400
 
-@app.errorhandler(DatabaseError)
+@routes.errorhandler(429)
+def too_many_requests(e):
+    notice = """429: Too many searches, please slow down!"""
+    return render_template('notice.html', notice=notice), 429, {'Retry-After': str(search_limiter().retry_after())}
+
+@routes.errorhandler(DatabaseError)
 def special_exception_handler(error):
     notice = """500: Something went wrong!"""
     return render_template('notice.html', notice=notice), 500
 
 
 if __name__ == '__main__':
+    app = create_app()
     app.debug = True
     app.run()
 
@@ -0,0 +1,466 @@
+import gzip
+import hashlib
+import importlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import jinja2
+from flask import request, send_from_directory, abort
+
+
+def _optional(name):
+    """
+    Imports a build dependency on first use, so web processes never load them. All of them are optional: without
+    brotli only gzip variants are written, without libsass the committed css is used as is, without rcssmin/rjsmin
+    the committed *.min files and without Pygments the committed highlighting css.
+    """
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        return None
+
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+SOURCE_DIRS = ['fonts', 'css', 'js']  # Fonts first, so stylesheets can point at their fingerprinted names
+COMPRESSIBLE = ('.css', '.js', '.svg', '.eot', '.ttf', '.otf')  # woff and woff2 are compressed already
+MAX_AGE = 365 * 24 * 60 * 60
+
+# Every page type loads exactly one stylesheet and one script bundle (plus whatever the page itself inlines)
+_base_css = ['css/bulma.min.css', 'css/font-awesome.min.css', 'css/highlight/pygments.min.css',
+             'css/base.min.css', 'css/navbar.min.css']
+_base_js = ['js/delete.min.js', 'js/navbar-burger.min.js', 'js/navbar-search.min.js']
+BUNDLE_DIR = 'bundles'
+BUNDLES = [
+    ('public.css', _base_css + ['css/post.min.css']),
+    ('public.js', _base_js),
+    ('compose.css', _base_css + ['css/simplemde.min.css', 'css/bulma-switch.min.css',
+                                 'css/tagify_bulma_flavoured.min.css', 'css/post.min.css']),
+    ('compose.js', _base_js + ['js/tagify.min.js', 'js/simplemde.min.js']),
+    ('admin.css', _base_css + ['css/sidebar.min.css', 'css/table.min.css']),
+    ('admin.js', _base_js + ['js/list_with_bulma.min.js']),
+]
+
+# Frameworks whose unused rules get pruned against the templates and scripts when bundling
+PRUNED = ['css/bulma.min.css', 'css/font-awesome.min.css']
+
+# Critical css gets inlined into base.html, so the first paint needs no stylesheet request. It is pruned against the
+# templates that make up the top of a public page only, without the safelist.
+CRITICAL_DIR = 'critical'
+CRITICAL = [
+    ('public.css', ['css/bulma.min.css', 'css/base.min.css', 'css/navbar.min.css', 'css/post.min.css'],
+     ['base.html', 'navbar.html', 'blog_list.html', 'post.html']),
+]
+
+_css_url_re = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+_css_comment_re = re.compile(r'/\*.*?\*/', re.S)
+_css_not_re = re.compile(r':not\([^)]*\)')
+_css_name_re = re.compile(r'[.#](-?[_a-zA-Z][\w-]*)')
+_token_re = re.compile(r'[\w-]+')
+_html_class_re = re.compile(r'\b(?:class|id)="([^"]*)"')
+
+
+########################################
+###             Building             ###
+########################################
+
+def build(static_folder, scss_folder=None, template_folder=None, safelist=(), pygments_style=None, log=print):
+    """
+    Builds the fingerprinted copies of all static files into static/dist together with their gzip (and brotli)
+    variants and a manifest that maps the original file names onto the fingerprinted ones. Bundles and critical css
+    get built as well, pruned against the templates if a template folder is given.
+    """
+    if scss_folder:
+        compile_scss(scss_folder, os.path.join(static_folder, 'css'), log)
+    if pygments_style:
+        write_pygments_css(pygments_style, os.path.join(static_folder, 'css', 'highlight'), log)
+    minify(static_folder, log)
+
+    dist_folder = os.path.join(static_folder, DIST_DIR)
+    if os.path.isdir(dist_folder):
+        shutil.rmtree(dist_folder)
+
+    manifest = {}
+    for source_dir in SOURCE_DIRS:
+        for filename in _list_files(static_folder, source_dir):
+            with open(os.path.join(static_folder, filename), 'rb') as f:
+                data = f.read()
+
+            if filename.endswith('.css'):
+                data = _rewrite_css_urls(data, filename, manifest)
+
+            fingerprinted = fingerprint(filename, data)
+            write_asset(dist_folder, fingerprinted, data)
+            manifest[filename] = fingerprinted
+
+    is_used = None
+    if template_folder:
+        is_used = _used_names_checker([os.path.join(template_folder, name) for name in os.listdir(template_folder)] +
+                                      [os.path.join(static_folder, name) for name in _list_files(static_folder, 'js')],
+                                      safelist)
+
+    for name, filenames in BUNDLES:
+        bundled = BUNDLE_DIR + '/' + name
+        data = bundle(static_folder, filenames, bundled, manifest, is_used)
+        manifest[bundled] = fingerprint(bundled, data)
+        write_asset(dist_folder, manifest[bundled], data)
+
+    for name, filenames, templates in CRITICAL:
+        critical = CRITICAL_DIR + '/' + name
+        if template_folder:
+            critical_is_used = _used_names_checker([os.path.join(template_folder, t) for t in templates], ())
+            data = bundle(static_folder, filenames, critical, manifest, critical_is_used, pruned=filenames,
+                          inline=True)
+        else:
+            data = b''
+        manifest[critical] = fingerprint(critical, data)
+        write_asset(dist_folder, manifest[critical], data)
+
+    with open(os.path.join(dist_folder, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    log("Built " + str(len(manifest)) + " assets into " + dist_folder)
+    return manifest
+
+
+def compile_scss(scss_folder, css_folder, log=print):
+    sass = _optional('sass')
+    if sass is None:
+        log("libsass is not installed, skipping scss compilation")
+        return
+
+    for name in sorted(os.listdir(scss_folder)):
+        if not name.endswith('.scss') or name.startswith('_'):  # Partials only get compiled through their importers
+            continue
+        base = name[:-len('.scss')]
+        path = os.path.join(scss_folder, name)
+        for output_style, css_name in (('expanded', base + '.css'), ('compressed', base + '.min.css')):
+            css = sass.compile(filename=path, output_style=output_style)
+            with open(os.path.join(css_folder, css_name), 'w') as f:
+                f.write(css)
+        log("Compiled " + name)
+
+
+def write_pygments_css(style, css_folder, log=print):
+    """Writes the stylesheet for the code blocks markdown highlights on the server."""
+    formatters = _optional('pygments.formatters')
+    rcssmin = _optional('rcssmin')
+    if formatters is None:
+        log("Pygments is not installed, skipping the highlighting css")
+        return
+
+    rules = [rule for rule in formatters.HtmlFormatter(style=style).get_style_defs('.highlight').splitlines()
+             if rule.startswith('.highlight')]
+    # Bulma gives every pre a light background of its own
+    rules.append('.highlight pre { background-color: inherit; color: inherit; }')
+    css = '\n'.join(rules) + '\n'
+    with open(os.path.join(css_folder, 'pygments.css'), 'w') as f:
+        f.write(css)
+    with open(os.path.join(css_folder, 'pygments.min.css'), 'w') as f:
+        f.write(rcssmin.cssmin(css) if rcssmin else css)
+    log("Wrote the " + style + " highlighting css")
+
+
+def minify(static_folder, log=print):
+    """Regenerates every *.min.css and *.min.js that has an unminified source next to it."""
+    rcssmin, rjsmin = _optional('rcssmin'), _optional('rjsmin')
+    if rcssmin is None or rjsmin is None:
+        log("rcssmin/rjsmin are not installed, skipping minification")
+        return
+
+    for source_dir, extension, minifier in (('css', '.css', rcssmin.cssmin), ('js', '.js', rjsmin.jsmin)):
+        for filename in _list_files(static_folder, source_dir):
+            if filename.endswith('.min' + extension) or not filename.endswith(extension):
+                continue
+            minified_name = filename[:-len(extension)] + '.min' + extension
+            minified_path = os.path.join(static_folder, minified_name)
+            if not os.path.exists(minified_path):
+                continue
+            with open(os.path.join(static_folder, filename)) as f:
+                minified = minifier(f.read())
+            with open(minified_path, 'w') as f:
+                f.write(minified)
+
+
+def bundle(static_folder, filenames, bundled, manifest, is_used=None, pruned=PRUNED, inline=False):
+    """
+    Concatenates static files into one. Stylesheets in pruned lose the rules is_used rejects, inline stylesheets
+    additionally lose their @font-face and @keyframes rules since relative urls do not work inside a page.
+    """
+    parts = []
+    for filename in filenames:
+        with open(os.path.join(static_folder, filename), 'rb') as f:
+            data = f.read()
+
+        if filename.endswith('.css'):
+            css = data.decode('utf-8')
+            if is_used is not None and filename in pruned:
+                css = prune_css(css, is_used, keep_at_rules=not inline)
+            data = _rewrite_css_urls(css.encode('utf-8'), filename, manifest, posixpath.dirname(bundled))
+        else:
+            data = data.rstrip() + b';'  # A missing semicolon at the end of one script must not break the next one
+
+        parts.append(data)
+    return b'\n'.join(parts)
+
+
+def prune_css(css, is_used, keep_at_rules=True):
+    """Removes all selectors that reference a class or id is_used rejects, and rules that are left without any."""
+    output = []
+    for prelude, body in _split_css(css):
+        if body is None:
+            if keep_at_rules:
+                output.append(prelude + ';')
+        elif prelude.startswith(('@media', '@supports')):
+            inner = prune_css(body, is_used, keep_at_rules)
+            if inner:
+                output.append(prelude + '{' + inner + '}')
+        elif prelude.startswith('@'):
+            if keep_at_rules:
+                output.append(prelude + '{' + body + '}')
+        else:
+            selectors = [selector for selector in _split_selectors(prelude)
+                         if all(is_used(name) for name in _css_name_re.findall(_css_not_re.sub('', selector)))]
+            if selectors:
+                output.append(','.join(selectors) + '{' + body + '}')
+    return ''.join(output)
+
+
+def fingerprint(filename, data):
+    """css/bulma.min.css -> css/bulma.min.<hash>.css"""
+    digest = hashlib.md5(data).hexdigest()[:12]
+    base, extension = posixpath.splitext(filename)
+    return base + '.' + digest + extension
+
+
+def write_asset(dist_folder, filename, data):
+    path = os.path.join(dist_folder, *filename.split('/'))
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    if not filename.endswith(COMPRESSIBLE):
+        return
+
+    gzipped = gzip_compress(data)
+    if len(gzipped) < len(data):
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzipped)
+
+    brotli = _optional('brotli')
+    if brotli is not None:
+        brotlied = brotli.compress(data, quality=11)
+        if len(brotlied) < len(data):
+            with open(path + '.br', 'wb') as f:
+                f.write(brotlied)
+
+
+def gzip_compress(data, level=9):
+    # mtime=0 keeps the output reproducible between builds
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level, mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+def _list_files(static_folder, source_dir):
+    filenames = []
+    for root, _, files in os.walk(os.path.join(static_folder, source_dir)):
+        for name in files:
+            relative = os.path.relpath(os.path.join(root, name), static_folder)
+            filenames.append(relative.replace(os.sep, '/'))
+    return sorted(filenames)
+
+
+def _rewrite_css_urls(data, filename, manifest, output_dir=None):
+    # Relative url()s (fonts of font-awesome, ...) have to point at the fingerprinted files as well
+    css_dir = posixpath.dirname(filename)
+    if output_dir is None:
+        output_dir = css_dir
+
+    def replace(match):
+        quote, url = match.group(1), match.group(2)
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = posixpath.normpath(posixpath.join(css_dir, path))
+        if target not in manifest:
+            return match.group(0)
+        return 'url(' + quote + posixpath.relpath(manifest[target], output_dir) + suffix + quote + ')'
+
+    return _css_url_re.sub(replace, data.decode('utf-8')).encode('utf-8')
+
+
+def _used_names_checker(paths, safelist):
+    # Every word in the class and id attributes of the templates counts as used. In scripts every word does, which is
+    # coarse, but catches the class names they add at runtime.
+    names = set()
+    for path in paths:
+        if not os.path.isfile(path):
+            continue
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        if path.endswith('.html'):
+            text = ' '.join(_html_class_re.findall(text))
+        names.update(_token_re.findall(text))
+    patterns = [re.compile(pattern) for pattern in safelist]
+
+    def is_used(name):
+        return name in names or any(pattern.match(name) for pattern in patterns)
+    return is_used
+
+
+def _split_css(css):
+    """Splits a stylesheet into its top level (prelude, body) pairs. Statements like @charset have no body."""
+    css = _css_comment_re.sub('', css)
+    blocks = []
+    i, n = 0, len(css)
+    while i < n:
+        j = i
+        while j < n and css[j] not in '{;':
+            j = _skip_string(css, j) if css[j] in '"\'' else j + 1
+        prelude = css[i:j].strip()
+        if j >= n:
+            break
+        if css[j] == ';':
+            if prelude:
+                blocks.append((prelude, None))
+            i = j + 1
+            continue
+
+        depth, k = 1, j + 1
+        while k < n and depth:
+            if css[k] in '"\'':
+                k = _skip_string(css, k)
+                continue
+            if css[k] == '{':
+                depth += 1
+            elif css[k] == '}':
+                depth -= 1
+            k += 1
+        blocks.append((prelude, css[j + 1:k - 1]))
+        i = k
+    return blocks
+
+
+def _split_selectors(prelude):
+    # Commas inside :not(...) and friends do not separate selectors
+    selectors, depth, start = [], 0, 0
+    for i, c in enumerate(prelude):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            selectors.append(prelude[start:i].strip())
+            start = i + 1
+    selectors.append(prelude[start:].strip())
+    return selectors
+
+
+def _skip_string(text, i):
+    quote, i = text[i], i + 1
+    while i < len(text) and text[i] != quote:
+        i += 2 if text[i] == '\\' else 1
+    return i + 1
+
+
+########################################
+###             Templates            ###
+########################################
+
+class TemplateBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """
+    Compiled templates on disk, so a new worker loads bytecode instead of compiling every template on first use.
+    Entries are keyed by template name only since the build may run in another directory than the app. Jinja compares
+    the checksum of the source, so a changed template still gets recompiled.
+    """
+
+    def get_cache_key(self, name, filename=None):
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+
+def precompile_templates(jinja_env, log=print):
+    """Compiles every template once, which fills the bytecode cache."""
+    names = [name for name in jinja_env.list_templates() if not posixpath.basename(name).startswith('.')]
+    for name in names:
+        jinja_env.get_template(name)
+    log("Compiled " + str(len(names)) + " templates")
+
+
+########################################
+###              Serving             ###
+########################################
+
+class Manifest(object):
+    """Lazily loaded mapping of static file names to their fingerprinted names in static/dist."""
+
+    def __init__(self, static_folder):
+        self.dist_folder = os.path.join(static_folder, DIST_DIR)
+        self.path = os.path.join(self.dist_folder, MANIFEST_NAME)
+        self.entries = None
+        self.contents = {}
+
+    def get(self, filename):
+        if self.entries is None:
+            self.reload()
+        return self.entries.get(filename)
+
+    def bundle(self, name):
+        """The fingerprinted bundle if it was built, otherwise the list of files that make it up."""
+        fingerprinted = self.get(BUNDLE_DIR + '/' + name)
+        if fingerprinted:
+            return [fingerprinted], True
+        return dict(BUNDLES).get(name, []), False
+
+    def read(self, filename):
+        """Contents of a built file (used for inlining), empty if it was not built."""
+        if filename not in self.contents:
+            fingerprinted = self.get(filename)
+            if fingerprinted:
+                with open(os.path.join(self.dist_folder, *fingerprinted.split('/')), encoding='utf-8') as f:
+                    self.contents[filename] = f.read()
+            else:
+                self.contents[filename] = ''
+        return self.contents[filename]
+
+    def reload(self):
+        self.contents = {}
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (IOError, ValueError):
+            self.entries = {}  # Not built (yet), templates fall back to the plain static files
+
+
+def send_asset(dist_folder, filename):
+    """Sends a fingerprinted file, preferring a precompressed variant the client accepts."""
+    if '..' in filename.split('/'):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] and os.path.isfile(os.path.join(dist_folder, filename + suffix)):
+            encoding = candidate
+            break
+
+    if encoding:
+        response = send_from_directory(dist_folder, filename + ('.br' if encoding == 'br' else '.gz'),
+                                       mimetype=mimetype)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(dist_folder, filename, mimetype=mimetype)
+
+    response.headers['Vary'] = 'Accept-Encoding'
+    # The name changes whenever the content does, so browsers never have to revalidate
+    response.headers['Cache-Control'] = 'public, max-age=' + str(MAX_AGE) + ', immutable'
+    return response
@@ -0,0 +1,248 @@
+from collections import OrderedDict, deque, namedtuple
+import threading
+import time
+from models import Post, User
+
+
+# Only the columns the sidebar needs are kept, so the buffer holds no model instances
+RecentPost = namedtuple('RecentPost', ['id', 'title', 'slug', 'created_at'])
+
+
+class RecentPosts(object):
+    """
+    Ring buffer of the newest published posts (newest first).
+
+    The buffer is filled per process and updated in place whenever this process publishes, unpublishes or deletes a
+    post, so rendering the recent posts sidebar mostly costs no database query. Changes made by other processes are
+    picked up by loading the buffer again once it is ttl seconds old.
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.size = None
+        self.expires = 0
+        self.entries = deque()
+        self.lock = threading.Lock()
+
+    def get(self, size):
+        with self.lock:
+            if size != self.size or time.monotonic() >= self.expires:
+                self._load(size)
+            return list(self.entries)
+
+    def publish(self, post):
+        with self.lock:
+            if self.size is None:
+                return  # Not loaded yet, the first get() will see the post anyway
+
+            self._remove(post.id)
+            entry = RecentPost(post.id, post.title, post.slug, post.created_at)
+
+            # Entries are sorted by created_at, so the new one goes in front of the first older entry
+            for i, other in enumerate(self.entries):
+                if entry.created_at >= other.created_at:
+                    self.entries.insert(i, entry)
+                    break
+            else:
+                self.entries.append(entry)
+
+            while len(self.entries) > self.size:
+                self.entries.pop()
+
+    def discard(self, post_id):
+        with self.lock:
+            if self.size is None:
+                return
+
+            was_full = len(self.entries) == self.size
+            if self._remove(post_id) and was_full:
+                # An older post moves up into the freed slot. This happens on the admin request that unpublished or
+                # deleted the post, never while rendering a page.
+                self._load(self.size)
+
+    def clear(self):
+        with self.lock:
+            self.size = None
+            self.entries = deque()
+
+    def _load(self, size):
+        size = max(int(size or 0), 0)
+        self.size = size
+        self.expires = time.monotonic() + self.ttl
+        self.entries = deque()
+        if size:
+            query = Post.select(Post.id, Post.title, Post.slug, Post.created_at)\
+                .where(Post.published)\
+                .order_by(Post.created_at.desc())\
+                .limit(size)
+            for post in query:
+                self.entries.append(RecentPost(post.id, post.title, post.slug, post.created_at))
+
+    def _remove(self, post_id):
+        for entry in self.entries:
+            if entry.id == post_id:
+                self.entries.remove(entry)
+                return True
+        return False
+
+
+class UserCache(object):
+    """
+    Short lived per-process cache for the user flask-login loads on every request of a logged-in user. Saving or
+    deleting a user invalidates its entry in this process, other processes pick the change up after ttl seconds.
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, uid):
+        uid = str(uid)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(uid)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+
+        try:
+            user = User.get(User.id == uid)
+        except User.DoesNotExist:
+            return None
+
+        with self.lock:
+            self.entries[uid] = (user, now + self.ttl)
+        return user
+
+    def invalidate(self, uid):
+        with self.lock:
+            self.entries.pop(str(uid), None)
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+
+class PostSlugs(object):
+    """
+    Map of post ids to slugs, so the redirect of a legacy /post/<id> url to the canonical /recipes/<slug> url needs no
+    database query. A blog has few enough posts to keep all of them. Only published posts are kept, their slugs are
+    public and never change again. Drafts are looked up every time, and only admins get their slug.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, post_id, admin=False):
+        with self.lock:
+            slug = self.entries.get(post_id)
+        if slug is not None:
+            return slug
+
+        post = Post.select(Post.slug, Post.published).where(Post.id == post_id).first()
+        if post is None:
+            return None
+
+        self.set(post_id, post.slug, post.published)
+        return post.slug if post.published or admin else None
+
+    def set(self, post_id, slug, published):
+        with self.lock:
+            if published:
+                self.entries[post_id] = slug
+            else:
+                self.entries.pop(post_id, None)
+
+    def discard(self, post_id):
+        with self.lock:
+            self.entries.pop(post_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries = {}
+
+
+class SingleFlight(object):
+    """
+    Lets concurrent calls for the same key share one execution: the first caller runs the function, the others wait
+    for its result (or exception). Works between the threads of one process.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResultCache(object):
+    """
+    LRU cache of computed results that expire after ttl seconds. Concurrent misses of the same key are computed once.
+    clear() drops everything, including results still being computed from data older than the clear.
+    """
+
+    def __init__(self, size=256, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.flight = SingleFlight()
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(key)
+                return entry[0]
+            generation = self.generation
+
+        return self.flight.do((generation, key), lambda: self._compute(key, compute, generation))
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+            self.generation += 1
+
+    def _compute(self, key, compute, generation):
+        result = compute()
+        with self.lock:
+            if generation == self.generation:
+                self.entries[key] = (result, time.monotonic() + self.ttl)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        return result
@@ -0,0 +1,135 @@
+from collections import OrderedDict
+import hashlib
+import threading
+import zlib
+from flask import request
+
+
+# Types worth compressing. Images, fonts and archives are compressed already, static files come precompressed from
+# 'flask assets' (see assets.send_asset).
+COMPRESSIBLE_TYPES = ('text/html', 'text/plain', 'text/css', 'text/xml', 'application/xml', 'application/atom+xml',
+                      'application/json', 'application/javascript', 'image/svg+xml')
+
+_brotli = None
+
+
+def load_brotli():
+    # Imported on first use, without the brotli package only gzip is offered
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli
+
+
+class Compressor(object):
+    """
+    Compresses responses with brotli or gzip, whichever the client accepts (brotli first). Bodies below min_size,
+    responses with a Content-Encoding of their own and types that don't shrink are sent as they are.
+
+    The compressed variants of complete bodies are kept in an LRU cache keyed by a digest of the body, so a page that
+    renders the same as before is not compressed again. Streamed responses are compressed chunk by chunk and flushed
+    after every chunk, so the client still receives each chunk as soon as it is produced.
+    """
+
+    def __init__(self, gzip_level=6, brotli_quality=5, min_size=500, cache_size=256):
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        self.cache_size = cache_size
+        self.variants = OrderedDict()
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.variants = OrderedDict()
+
+    def negotiate(self):
+        """The encoding to use for the current request, None for none."""
+        if request.accept_encodings['br'] and load_brotli():
+            return 'br'
+        if request.accept_encodings['gzip']:
+            return 'gzip'
+        return None
+
+    def compress_response(self, response):
+        if response.mimetype not in COMPRESSIBLE_TYPES \
+                or response.status_code < 200 or response.status_code in (204, 206, 304) \
+                or response.direct_passthrough \
+                or 'Content-Encoding' in response.headers \
+                or response.cache_control.no_transform:
+            return response
+
+        # The response depends on Accept-Encoding, whether it ends up compressed or not
+        response.vary.add('Accept-Encoding')
+
+        encoding = self.negotiate()
+        if encoding is None or request.method == 'HEAD':
+            return response
+
+        if response.is_streamed:
+            response.response = self._compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                return response
+            response.set_data(self.compressed(data, encoding))
+
+        response.headers['Content-Encoding'] = encoding
+        if response.headers.get('ETag'):
+            # A compressed body is a different representation (and a weak ETag stays valid for it)
+            etag, weak = response.get_etag()
+            if not weak:
+                response.set_etag(etag + '-' + encoding)
+        return response
+
+    def compressed(self, data, encoding):
+        """Compressed variant of data, from the cache if the same body was compressed before."""
+        key = (hashlib.sha1(data).digest(), encoding)
+        with self.lock:
+            variant = self.variants.get(key)
+            if variant is not None:
+                self.variants.move_to_end(key)
+                return variant
+
+        if encoding == 'br':
+            variant = load_brotli().compress(data, quality=self.brotli_quality)
+        else:
+            variant = _gzip(data, self.gzip_level)
+
+        with self.lock:
+            self.variants[key] = variant
+            while len(self.variants) > self.cache_size:
+                self.variants.popitem(last=False)
+        return variant
+
+    def _compress_stream(self, chunks, encoding):
+        if encoding == 'br':
+            compressor = load_brotli().Compressor(quality=self.brotli_quality)
+            compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            compress, flush, finish = compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), \
+                compressor.flush
+
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                data = compress(chunk) + flush()
+                if data:
+                    yield data
+            yield finish()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+
+def _gzip(data, level):
+    # gzip container without a file name or timestamp, so equal bodies give equal bytes
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
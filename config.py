@@ -5,3 +5,89 @@ class Config(object):
     TESTING = True
     SECRET_KEY = "31t158yuaj2289iusysxd987as8cqjgkl3p97jsbtxsaq"
     DATABASE_URL = os.environ.get("TRUNKS_DATABASE_URL")
+
+    # Connection settings of a sqlite:/// DATABASE_URL: the write-ahead log lets readers and the one writer work at the
+    # same time, a 64 MB page cache and memory mapped reads keep the hot pages out of the file system
+    SQLITE_PRAGMAS = {'journal_mode': 'wal',
+                      'synchronous': 'normal',
+                      'cache_size': -64000,
+                      'mmap_size': 268435456,
+                      'foreign_keys': 1}
+
+    # Number of proxies in front of the app that append to X-Forwarded-For (Heroku's router is one)
+    PROXY_COUNT = 1
+
+    # Seconds a logged-in user is kept in the per-process cache before it is loaded from the database again
+    USER_CACHE_TTL = 30
+
+    # Seconds the recent posts sidebar of a process may lag behind posts published or deleted by other processes
+    RECENT_POSTS_TTL = 30
+
+    # bcrypt work factor, number of hashing threads per process, how many hashes one client may have running at once,
+    # how long a request waits for the pool and how many hashes may be queued or running in the process at all. The
+    # last must stay below the threads of a gunicorn worker (gunicorn.conf.py), or logins could tie up all of them.
+    BCRYPT_ROUNDS = 12
+    BCRYPT_WORKERS = 2
+    BCRYPT_MAX_PER_CLIENT = 2
+    BCRYPT_TIMEOUT = 10
+    BCRYPT_MAX_PENDING = 4
+
+    # Searches a client may start at once and per second after that (per process), and how many search result pages
+    # are cached for how many seconds. Saving a post clears the cache of the process that saved it.
+    SEARCH_BURST = 10
+    SEARCH_RATE = 0.5
+    SEARCH_CACHE_SIZE = 256
+    SEARCH_CACHE_TTL = 60
+
+    # Most markdown blocks the editor may send for a live preview in one request
+    PREVIEW_MAX_BLOCKS = 1000
+
+    # Compression of the dynamic responses: gzip level (1-9) and brotli quality (0-11), bodies smaller than
+    # COMPRESSION_MIN_SIZE bytes go out uncompressed, the compressed variants of that many bodies are kept per process
+    COMPRESSION_GZIP_LEVEL = 6
+    COMPRESSION_BROTLI_QUALITY = 5
+    COMPRESSION_MIN_SIZE = 500
+    COMPRESSION_CACHE_SIZE = 256
+
+    # Background job worker ('flask worker'): seconds between polls of an empty queue, seconds after which a running
+    # job counts as abandoned, days finished jobs are kept
+    JOB_POLL_INTERVAL = 1
+    JOB_TIMEOUT = 300
+    JOB_KEEP_DAYS = 7
+
+    # Static export ('flask export'): target folder, number of rendering processes and the address the exported
+    # site is served from (used for the absolute links in the feed). With EXPORT_FOLDER set, the worker re-exports
+    # the changed pages whenever a post is saved or deleted.
+    EXPORT_FOLDER = os.environ.get("TRUNKS_EXPORT_FOLDER")
+    EXPORT_PROCESSES = 4
+    EXPORT_BASE_URL = os.environ.get("TRUNKS_EXPORT_BASE_URL", "http://localhost/")
+
+    # Sitemaps for crawlers (see sitemap.py): folder they are kept in, the address of the site for their urls and the
+    # seconds after which /sitemap.xml brings them up to date itself. The worker updates them whenever a post is saved
+    # or deleted, web processes that don't share its disk rely on the check. Without a base url nothing writes them,
+    # /sitemap.xml serves the files that are there (if any).
+    SITEMAP_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.sitemaps')
+    SITEMAP_BASE_URL = os.environ.get("TRUNKS_SITEMAP_BASE_URL")
+    SITEMAP_MAX_AGE = 3600
+
+    # Profiling of single requests (see profiler.py): admins opt in with ?profile=1 or a cookie from /admin/profiles.
+    # The stack of a profiled request is sampled every PROFILE_SAMPLE_INTERVAL seconds, which is cheap enough for
+    # production. PROFILE_DETERMINISTIC adds cProfile stats (precise, but slows the request down considerably), so it
+    # is off by default. The newest PROFILE_KEEP profiles are kept.
+    PROFILE_ENABLED = True
+    PROFILE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.profiles')
+    PROFILE_SAMPLE_INTERVAL = 0.005
+    PROFILE_DETERMINISTIC = False
+    PROFILE_KEEP = 50
+
+    # Classes that only get assembled at runtime (flash categories, the navbar icons from the settings) and must
+    # survive pruning the css bundles against the templates
+    ASSET_PRUNE_SAFELIST = [r'^is-(success|danger|warning|info|primary|link)$',
+                            r'^fa-(github|gitlab|linkedin|twitter|facebook|instagram|pinterest|youtube|envelope|rss|'
+                            r'home|user|heart|cutlery|coffee)']
+
+    # Folder of the compiled templates, filled by 'flask precompile'. None compiles templates in memory only.
+    TEMPLATE_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.template_cache')
+
+    # Pygments style of the code blocks in posts, 'flask assets' writes its css
+    PYGMENTS_STYLE = 'monokai'
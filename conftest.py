@@ -0,0 +1,23 @@
+import pytest
+import app
+import config
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Builds apps on SQLite databases of their own in tmp_path, config overrides as keyword arguments."""
+    def make(name='blog', **settings):
+        class TestConfig(config.Config):
+            DATABASE_URL = 'sqlite:///' + str(tmp_path / (name + '.db'))
+            TEMPLATE_CACHE_FOLDER = None
+            SITEMAP_FOLDER = str(tmp_path / (name + '-sitemaps'))
+            PROFILE_FOLDER = str(tmp_path / (name + '-profiles'))
+            BCRYPT_ROUNDS = 4
+        for key, value in settings.items():
+            setattr(TestConfig, key, value)
+
+        application = app.create_app(TestConfig)
+        result = application.test_cli_runner().invoke(args=['initdb'])
+        assert result.exit_code == 0, result.output
+        return application
+    return make
@@ -0,0 +1,249 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from flask import url_for
+from werkzeug.urls import url_unquote
+from playhouse.shortcuts import model_to_dict
+from models import Post, PostTag, Tag, PostUser, User, database
+import util
+
+
+STATE_NAME = '.export-state.json'
+
+# The app whose pages the pool processes render and the folder they write to. Both are set before the pool forks, so
+# every process inherits them.
+_app = None
+_output_folder = None
+
+
+def export(app, output_folder, processes=4, incremental=False, base_url=None, log=print):
+    """
+    Renders the public pages (archive, date archive, posts, tags, users and the feed) into static html files below
+    output_folder, laid out like the urls, so a plain file server or CDN can serve them. Search, login and admin stay
+    with Flask.
+
+    An incremental export compares the published posts with the state the last export left behind and only renders
+    the pages whose content changed, and the listing pages whose posts shifted. If the sidebar (recent posts, posts
+    per month) changed, the blog's pages and those of the months it counts differently get it too, the other pages
+    with their next change or the next full export. A full export is built next to the
+    live site and swapped in when it is complete: output_folder is a symlink to the current build.
+    """
+    global _app, _output_folder
+
+    live_folder = os.path.realpath(output_folder) if os.path.isdir(output_folder) else None
+    state_path = os.path.join(live_folder, STATE_NAME) if live_folder else None
+    previous = None
+    if incremental and state_path and os.path.isfile(state_path):
+        with open(state_path) as f:
+            previous = json.load(f)
+
+    current = collect_state(util.get_current_settings())
+
+    if previous is None or previous['settings'] != current['settings']:
+        # Everything (or the navbar on every page) changed
+        previous = None
+        target_folder = _new_build_folder(output_folder)
+        shutil.copytree(app.static_folder, os.path.join(target_folder, 'static'))
+    else:
+        target_folder = live_folder
+
+    with app.test_request_context(base_url=base_url):
+        render_urls, remove_urls = affected_urls(previous, current)
+
+    for url in remove_urls:
+        path = _file_path(target_folder, url)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    # Forked processes must not share the connection of their parent. The pool has to fork (not spawn) to inherit _app.
+    database.close()
+    _app, _output_folder = app, target_folder
+    try:
+        pool = multiprocessing.get_context('fork').Pool(processes, initializer=database.close)
+        try:
+            for url, status in pool.imap_unordered(_render, sorted(render_urls), chunksize=8):
+                if status != 200:
+                    log("Export of " + url + " returned " + str(status))
+        finally:
+            pool.close()
+            pool.join()
+
+        # The blog's front page is the first archive page
+        with app.test_request_context(base_url=base_url):
+            front_page = _file_path(target_folder, url_for('blog', page=1))
+        if os.path.isfile(front_page):
+            shutil.copyfile(front_page, os.path.join(target_folder, 'index.html'))
+
+        with open(os.path.join(target_folder, STATE_NAME), 'w') as f:
+            json.dump(current, f)
+    except BaseException:
+        if target_folder != live_folder:
+            shutil.rmtree(target_folder, ignore_errors=True)  # The live site stays as it was
+        raise
+
+    if target_folder != live_folder:
+        _swap(output_folder, target_folder)
+
+    log("Exported " + str(len(render_urls)) + " pages, removed " + str(len(remove_urls)))
+    return render_urls
+
+
+def _new_build_folder(output_folder):
+    parent, name = os.path.split(os.path.abspath(output_folder))
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    return tempfile.mkdtemp(prefix='.' + name + '-', dir=parent)
+
+
+def _swap(output_folder, build_folder):
+    """Points output_folder at build_folder in one rename, then removes the previous build."""
+    output_folder = os.path.abspath(output_folder)
+    old_folder = None
+    if os.path.islink(output_folder):
+        old_folder = os.path.realpath(output_folder)
+    elif os.path.isdir(output_folder):
+        # A plain folder (from before exports were swapped in) can't be replaced atomically, only this once
+        old_folder = output_folder + '.old'
+        if os.path.isdir(old_folder):
+            shutil.rmtree(old_folder)
+        os.rename(output_folder, old_folder)
+
+    link = build_folder + '.link'
+    os.symlink(os.path.basename(build_folder), link)
+    os.replace(link, output_folder)
+
+    if old_folder and old_folder != build_folder:
+        shutil.rmtree(old_folder, ignore_errors=True)
+
+
+def collect_state(settings):
+    """What the public pages are made of: the settings, every published post's version and the order of every listing."""
+    posts = Post.select(Post.id, Post.slug, Post.updated_at, Post.created_at)\
+        .where(Post.published)\
+        .order_by(Post.created_at.desc())
+
+    listings = {'blog': []}
+    versions = {}
+    for post in posts:
+        listings['blog'].append(post.id)
+        listings.setdefault('year/' + str(post.created_at.year), []).append(post.id)
+        listings.setdefault('month/' + post.created_at.strftime('%Y/%m'), []).append(post.id)
+        versions[str(post.id)] = [post.slug, post.updated_at.isoformat()]
+
+    tagged = PostTag.select(PostTag.post, Tag.name)\
+        .join(Tag).switch(PostTag).join(Post)\
+        .where(Post.published)\
+        .order_by(Post.created_at.desc())\
+        .tuples()
+    for post_id, tag_name in tagged:
+        listings.setdefault('tag/' + tag_name, []).append(post_id)
+        versions[str(post_id)].append(tag_name)  # Renaming a tag changes every page that shows the post
+    for version in versions.values():
+        version[2:] = sorted(version[2:])
+
+    authored = PostUser.select(PostUser.post, User.name)\
+        .join(User).switch(PostUser).join(Post)\
+        .where(Post.published)\
+        .order_by(Post.created_at.desc())\
+        .tuples()
+    for post_id, user_name in authored:
+        listings.setdefault('user/' + user_name, []).append(post_id)
+
+    recent = [[post_id, versions[str(post_id)]] for post_id in listings['blog'][:settings.number_of_recent_posts]]
+    # The archive sidebar shows the number of posts per month
+    months = sorted([listing, len(post_ids)] for listing, post_ids in listings.items() if listing.startswith('month/'))
+    return {'settings': model_to_dict(settings),
+            'recent': recent,
+            'months': months,
+            'versions': versions,
+            'listings': listings}
+
+
+def affected_urls(previous, current):
+    """Urls to render and urls whose pages no longer exist. Has to run in a request context."""
+    per_page = int(current['settings']['posts_per_page'])
+    render_urls, remove_urls = set(), set()
+
+    changed_posts = set()
+    old_versions = previous['versions'] if previous else {}
+    for post_id, version in current['versions'].items():
+        if old_versions.get(post_id) != version:
+            changed_posts.add(int(post_id))
+            render_urls.add(url_for('post', slug=version[0]))
+    for post_id, version in old_versions.items():
+        if current['versions'].get(post_id) != version:
+            changed_posts.add(int(post_id))
+            if post_id not in current['versions'] or current['versions'][post_id][0] != version[0]:
+                remove_urls.add(url_for('post', slug=version[0]))
+
+    old_listings = previous['listings'] if previous else {}
+    sidebar_listings = set()
+    if previous is not None and previous['recent'] != current['recent']:
+        sidebar_listings.add('blog')
+    if previous is not None and previous.get('months') != current['months']:
+        sidebar_listings.add('blog')
+        sidebar_listings.update(listing for listing, count in current['months']
+                                if [listing, count] not in previous.get('months', []))
+
+    for listing in set(current['listings']) | set(old_listings):
+        new_ids = current['listings'].get(listing, [])
+        old_ids = old_listings.get(listing, [])
+
+        # Every page from the first position where the order differs changes, as does every page showing a changed post
+        first_shift = next((i for i, (a, b) in enumerate(zip(new_ids, old_ids)) if a != b), min(len(new_ids), len(old_ids)))
+        if len(new_ids) == len(old_ids) and first_shift == len(new_ids):
+            first_shift = None
+        pages = set(i // per_page + 1 for i, post_id in enumerate(new_ids)
+                    if post_id in changed_posts or (first_shift is not None and i >= first_shift)
+                    or listing in sidebar_listings)
+
+        new_page_count = (len(new_ids) + per_page - 1) // per_page
+        old_page_count = (len(old_ids) + per_page - 1) // per_page
+        for page in pages:
+            render_urls.add(_listing_url(listing, page))
+        for page in range(new_page_count + 1, old_page_count + 1):
+            remove_urls.add(_listing_url(listing, page))
+
+    if previous is None or current['listings']['blog'] != old_listings.get('blog') or changed_posts:
+        render_urls.add(url_for('feed'))
+
+    return render_urls, remove_urls - render_urls
+
+
+def _listing_url(listing, page):
+    kind, _, name = listing.partition('/')
+    if kind == 'blog':
+        return url_for('blog', page=page)
+    elif kind == 'year':
+        return url_for('archive_view', year=int(name), page=page)
+    elif kind == 'month':
+        year, month = name.split('/')
+        return url_for('archive_view', year=int(year), month=int(month), page=page)
+    elif kind == 'tag':
+        return url_for('tag_view', tag_name=name, page=page)
+    else:
+        return url_for('user_view', user_name=name, page=page)
+
+
+def _file_path(output_folder, url):
+    path = url_unquote(url).strip('/')
+    parts = [part for part in path.split('/') if part not in ('', '.', '..')]
+    if parts and '.' in parts[-1]:
+        return os.path.join(output_folder, *parts)  # feed.xml and friends keep their name
+    return os.path.join(output_folder, *(parts + ['index.html']))
+
+
+def _render(url):
+    # Runs in the pool processes, as an anonymous reader
+    client = _app.test_client()
+    response = client.get(url)
+    if response.status_code == 200:
+        path = _file_path(_output_folder, url)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, 'wb') as f:
+            f.write(response.get_data())
+    return url, response.status_code
@@ -0,0 +1,24 @@
+# gunicorn settings, see Procfile. The app gets loaded and warmed up once in the master process, the workers are
+# forked from it and share its memory copy-on-write.
+
+preload_app = True
+
+# Each worker process serves requests on several threads, so requests waiting for a password hash (see passwords.py)
+# leave the others free. Keep BCRYPT_MAX_PENDING below threads.
+worker_class = 'gthread'
+threads = 8
+
+
+def when_ready(server):
+    import app
+    app.warm_up(server.app.wsgi())
+
+
+def pre_fork(server, worker):
+    import app
+    app.before_fork(server.app.wsgi())
+
+
+def post_fork(server, worker):
+    import app
+    app.after_fork(server.app.wsgi())
@@ -0,0 +1,149 @@
+import datetime
+import json
+import time
+import traceback
+from flask import current_app
+from peewee import IntegrityError
+from models import Job, Post, database, uses_sqlite
+import export
+import sitemap
+import render
+
+
+# Job kinds and the functions that run them. A handler gets the job's key and its (json decoded) payload.
+handlers = {}
+
+
+def handler(kind):
+    def decorator(f):
+        handlers[kind] = f
+        return f
+    return decorator
+
+
+def enqueue(kind, key=None, payload=None, max_attempts=5):
+    """
+    Queues a job. As long as a job of the same kind and key is still pending no second one gets queued (a partial
+    unique index makes the insert a no-op), so saving a post ten times in a row runs its side effects once.
+    """
+    Job.insert(kind=kind,
+               key=None if key is None else str(key),
+               payload=json.dumps(payload or {}),
+               max_attempts=max_attempts)\
+        .on_conflict_ignore()\
+        .execute()
+
+
+def claim(timeout):
+    """Takes the next due job. SKIP LOCKED lets any number of workers poll the table without blocking each other."""
+    now = datetime.datetime.now()
+    stale = now - datetime.timedelta(seconds=timeout)  # Running jobs of a worker that died get picked up again
+    # ... unless they used up their attempts, a job that kills the worker every time must not do so forever
+    Job.update(status='failed', last_error='Worker died while running the job', updated_at=now)\
+        .where((Job.status == 'running') & (Job.updated_at < stale) & (Job.attempts >= Job.max_attempts))\
+        .execute()
+    due = Job.select()\
+        .where(((Job.status == 'pending') & (Job.run_at <= now))
+               | ((Job.status == 'running') & (Job.updated_at < stale) & (Job.attempts < Job.max_attempts)))\
+        .order_by(Job.run_at)\
+        .limit(1)
+    if uses_sqlite():
+        return _claim_unlocked(due, now)
+    with database.atomic():
+        job = due.for_update('FOR UPDATE SKIP LOCKED').first()
+        if job is not None:
+            job.status = 'running'
+            job.attempts += 1
+            job.updated_at = now
+            job.save()
+    return job
+
+
+def _claim_unlocked(due, now):
+    # SQLite has no row locks. The update only takes the job if no other worker changed it since it was read.
+    job = due.first()
+    if job is None:
+        return None
+    claimed = Job.update(status='running', attempts=Job.attempts + 1, updated_at=now)\
+        .where((Job.id == job.id) & (Job.status == job.status) & (Job.updated_at == job.updated_at))\
+        .execute()
+    if not claimed:
+        return None
+    job.status, job.attempts, job.updated_at = 'running', job.attempts + 1, now
+    return job
+
+
+def run(job):
+    try:
+        handlers[job.kind](job.key, json.loads(job.payload))
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            # Back off exponentially: 10s, 20s, 40s, ...
+            job.status = 'pending'
+            job.run_at = datetime.datetime.now() + datetime.timedelta(seconds=5 * 2 ** job.attempts)
+        else:
+            job.status = 'failed'
+    else:
+        job.status = 'done'
+    job.updated_at = datetime.datetime.now()
+    try:
+        with database.atomic():
+            job.save()
+    except IntegrityError:
+        # The same job got queued again while this one ran. The pending one runs anyway, it takes the retry's place.
+        job.status = 'superseded'
+        job.save()
+    return job.status
+
+
+def work(poll_interval=1, timeout=300, keep_days=7, log=print):
+    """Runs jobs until interrupted, the entry point of the worker process."""
+    last_cleanup = 0
+    while True:
+        job = claim(timeout)
+        if job is None:
+            if time.time() - last_cleanup > 3600:
+                Job.delete()\
+                    .where(Job.status.in_(['done', 'superseded'])
+                           & (Job.updated_at < datetime.datetime.now() - datetime.timedelta(days=keep_days)))\
+                    .execute()
+                last_cleanup = time.time()
+            time.sleep(poll_interval)
+            continue
+
+        status = run(job)
+        log("Job " + str(job.id) + " (" + job.kind + " " + str(job.key) + "): " + status)
+
+
+########################################
+###             Handlers             ###
+########################################
+
+@handler('post_saved')
+def post_saved(post_id, payload):
+    post = Post.get_or_none(Post.id == post_id)
+    if post is None:
+        return  # Deleted in the meantime
+
+    Post.update(content_html=render.render_markdown(post.content)).where(Post.id == post.id).execute()
+
+
+@handler('export')
+def export_site(key, payload):
+    # Runs inside the app context of 'flask worker'
+    app = current_app._get_current_object()
+    export.export(app, app.config['EXPORT_FOLDER'],
+                  processes=app.config['EXPORT_PROCESSES'],
+                  incremental=True,
+                  base_url=app.config['EXPORT_BASE_URL'])
+
+
+@handler('sitemap')
+def update_sitemap(key, payload):
+    app = current_app._get_current_object()
+    if not app.config['SITEMAP_BASE_URL']:
+        # Urls below a guessed address would send crawlers astray, /sitemap.xml updates them from its own address
+        app.logger.warning("SITEMAP_BASE_URL is not set, skipping the sitemaps")
+        return
+    sitemap.update(app, app.config['SITEMAP_FOLDER'], base_url=app.config['SITEMAP_BASE_URL'])
@@ -1,23 +1,66 @@
-from peewee import PostgresqlDatabase, Model, TextField, CharField, DateTimeField, ForeignKeyField, BooleanField, IntegerField, SQL
+from peewee import Model, TextField, CharField, DateTimeField, ForeignKeyField, BooleanField, IntegerField, Proxy, CompositeKey
 from playhouse.postgres_ext import PostgresqlExtDatabase # necessary for full text search
-from datetime import datetime
-from config import Config
+from playhouse.sqlite_ext import SqliteExtDatabase, FTS5Model, SearchField
+from datetime import datetime, date
 import urllib.parse
-
-
-db_parsed_url = urllib.parse.urlparse(Config.DATABASE_URL)
-username = db_parsed_url.username
-password = db_parsed_url.password
-database = db_parsed_url.path[1:]
-hostname = db_parsed_url.hostname
-postgres_db = PostgresqlExtDatabase(
-                database=database,
-                user=username,
-                password=password,
-                host=hostname,
-                autocommit=True,
-                autorollback=True,
-                register_hstore=True)
+from flask import current_app, has_app_context
+
+
+class AppDatabase(Proxy):
+    """
+    Placeholder the models are bound to. Inside an app context it stands for the database create_app opened for that
+    app (app.extensions['database']), outside of one for the database init_database connected.
+    """
+    __slots__ = ('obj', '_callbacks')
+
+    def current(self):
+        if has_app_context() and 'database' in current_app.extensions:
+            return current_app.extensions['database']
+        if self.obj is None:
+            raise AttributeError('No app context and no database initialized.')
+        return self.obj
+
+    def __getattr__(self, attr):
+        return getattr(self.current(), attr)
+
+    def __enter__(self):
+        return self.current().__enter__()
+
+    def __exit__(self, *args):
+        return self.current().__exit__(*args)
+
+
+database = AppDatabase()
+
+def open_database(database_url, sqlite_pragmas=None):
+    """
+    Opens the database of the url: sqlite:///relative/path.db, sqlite:////absolute/path.db or a postgresql:// url (the
+    default).
+    """
+    db_parsed_url = urllib.parse.urlparse(database_url)
+    if db_parsed_url.scheme == 'sqlite':
+        return SqliteExtDatabase(db_parsed_url.path[1:], pragmas=sqlite_pragmas or {})
+
+    username = db_parsed_url.username
+    password = db_parsed_url.password
+    database_name = db_parsed_url.path[1:]
+    hostname = db_parsed_url.hostname
+    return PostgresqlExtDatabase(
+                    database=database_name,
+                    user=username,
+                    password=password,
+                    host=hostname,
+                    autocommit=True,
+                    autorollback=True,
+                    register_hstore=True)
+
+def init_database(database_url, sqlite_pragmas=None):
+    """Connects the models to the database of the url outside of app contexts (scripts and tests)."""
+    database.initialize(open_database(database_url, sqlite_pragmas))
+    return database
+
+def uses_sqlite():
+    return isinstance(database.current(), SqliteExtDatabase)
 
 class User(Model):
     name = TextField(unique=True)
@@ -43,19 +86,21 @@ class User(Model):
         return False
 
     class Meta:
-        database = postgres_db
+        database = database
 
 class Post(Model):
     title = TextField()
     description = TextField()
     content = TextField()
-    slug = TextField()
+    content_html = TextField(null=True)  # content rendered (and highlighted) on save
+    slug = TextField(unique=True)  # /recipes/<slug>, made unique by util.unique_slug
     published = BooleanField(default=False)
+    first_published_at = DateTimeField(null=True)  # The slug is fixed from then on, even if the post gets unpublished
     created_at = DateTimeField(default=datetime.now)
     updated_at = DateTimeField(default=datetime.now)
 
     class Meta:
-        database = postgres_db
+        database = database
 # Adding gin index to Post.content before first request
 
 class PostUser(Model):
@@ -63,7 +108,7 @@ class PostUser(Model):
     user = ForeignKeyField(User, null=True)
 
     class Meta:
-        database = postgres_db
+        database = database
         indexes = (
             (('post', 'user'), True),  # Note the trailing comma!
         )
@@ -74,7 +119,7 @@ class Tag(Model):
     updated_at = DateTimeField(default=datetime.now)
 
     class Meta:
-        database = postgres_db
+        database = database
 # Adding gin index to Tag.name before first request
 
 
@@ -83,7 +128,7 @@ class PostTag(Model):
     tag = ForeignKeyField(Tag, null=True)
 
     class Meta:
-        database = postgres_db
+        database = database
         indexes = (
             (('post', 'tag'), True),  # Note the trailing comma!
         )
@@ -101,8 +146,55 @@ class Settings(Model):
 
     posts_per_page = IntegerField()
     max_synopsis_chars = IntegerField()
+    number_of_recent_posts = IntegerField(default=5)
 
     table_entries_per_page = TextField()
 
     class Meta:
-        database = postgres_db
+        database = database
+
+
+# Number of published posts per month, for the archive sidebar. Kept up to date by queries.update_post_months whenever
+# a post is saved or deleted, 'flask initdb' recounts all of them.
+class PostMonth(Model):
+    year = IntegerField()
+    month = IntegerField()
+    count = IntegerField(default=0)
+
+    @property
+    def start(self):
+        return date(self.year, self.month, 1)
+
+    class Meta:
+        database = database
+        primary_key = CompositeKey('year', 'month')
+
+
+# Queue of background jobs (see jobs.py). A partial unique index on (kind, key) WHERE status = 'pending' keeps pending
+# jobs unique, it gets created before first request.
+class Job(Model):
+    kind = TextField()
+    key = TextField(null=True)
+    payload = TextField(default='{}')
+    status = TextField(default='pending')  # pending, running, done, failed or superseded (by a pending retry)
+    attempts = IntegerField(default=0)
+    max_attempts = IntegerField(default=5)
+    last_error = TextField(null=True)
+    run_at = DateTimeField(default=datetime.now)
+    created_at = DateTimeField(default=datetime.now)
+    updated_at = DateTimeField(default=datetime.now)
+
+    class Meta:
+        database = database
+
+
+# Full text index of the posts for SQLite, which has no to_tsvector. The rowid is the post's id, see
+# queries.update_search_index. Only 'flask initdb' on a SQLite database creates the table.
+class PostIndex(FTS5Model):
+    title = SearchField()
+    content = SearchField()
+    tags = SearchField()
+
+    class Meta:
+        database = database
+        options = {'tokenize': 'porter unicode61'}  # Stemmed like Postgres' english configuration
@@ -1,6 +1,7 @@
-from math import floor, ceil
+from math import ceil
 
 class Page(object):
+    __slots__ = ('number', 'active', 'divider')
 
     def __init__(self, number, active=False, divider=False):
         self.active = active
@@ -14,40 +15,26 @@ class Page(object):
             return "..."
 
 class Pagination(object):
+    """
+    Page links of a listing. The page count is computed once, the window of Page elements only when a template asks
+    for it. With room for at least five elements, a window that doesn't reach the first or last page is joined to
+    them by a divider: 1 ... 6 7 8 ... 20.
+    """
+
+    __slots__ = ('page', 'per_page', 'total_count', 'num_elements', 'page_count', '_elements')
 
     def __init__(self, page, per_page, total_count, num_elements):
         self.page = page
         self.per_page = per_page
         self.total_count = total_count
         self.num_elements = num_elements
-
-        self.elements = []
-
-        lowest = 1
-        highest = self.page_count
-
-        first = page - (num_elements//2)
-        last = page + (num_elements//2)
-
-        if first < 1 and first != 0:
-            last += -(first - 1)
-            first = 1
-        elif first == 0:
-            last += 1
-            first = 1
-
-        if last > self.page_count:
-            offset = last - self.page_count
-            first = max(first - offset, 1)
-            last = self.page_count
-
-        for i in range(first, last+1):
-            self.elements.append(Page(i))
-
+        self.page_count = int(ceil(total_count / float(per_page)))
+        self._elements = None
 
     @property
-    def page_count(self):
-        return int(ceil(self.total_count / float(self.per_page)))
+    def out_of_range(self):
+        # The first page always exists, even if there's nothing on it
+        return self.page < 1 or (self.page > self.page_count and self.page != 1)
 
     @property
     def has_prev(self):
@@ -63,6 +50,38 @@ class Pagination(object):
     def has_next(self):
         return self.page < self.page_count
 
+    @property
+    def elements(self):
+        if self._elements is None:
+            self._elements = [Page(number, active=number == self.page, divider=number is None)
+                              for number in self._window()]
+        return self._elements
+
+    def _window(self):
+        """Page numbers to show, None for a divider."""
+        count, size, page = self.page_count, self.num_elements, self.page
+
+        if count <= size:
+            return list(range(1, count + 1))
+
+        if size < 5:
+            # No room for dividers, just the pages around the current one
+            first = min(max(page - size // 2, 1), count - size + 1)
+            return list(range(first, first + size))
+
+        # First page, divider, middle, divider, last page
+        middle = size - 4
+        left = (middle - 1) // 2
+        right = middle - 1 - left
+        if page - left <= 3:
+            return list(range(1, size - 1)) + [None, count]
+        if page + right >= count - 2:
+            return [1, None] + list(range(count - size + 3, count + 1))
+        return [1, None] + list(range(page - left, page + right + 1)) + [None, count]
+
+    def __iter__(self):
+        return iter(self.elements)
+
     def __getitem__(self, i):
         return self.elements[i]
 
@@ -94,3 +113,15 @@ if __name__ == "__main__":
     print("For page 20:")
     p = Pagination(20, 10, 200, 7)
     print([str(x) for x in p.elements])
+
+    print("For page 3 of 4:")
+    p = Pagination(3, 10, 40, 7)
+    print([str(x) for x in p.elements])
+
+    print("For page 3 of 20, 3 elements:")
+    p = Pagination(3, 10, 200, 3)
+    print([str(x) for x in p.elements])
+
+    print("For page 21 of 20:")
+    p = Pagination(21, 10, 200, 7)
+    print(p.out_of_range)
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import threading
+
+
+class TooManyAttempts(Exception):
+    """Raised if a client already has all its password checks running or the pool is too busy to take another."""
+
+
+class PasswordHasher(object):
+    """
+    Runs bcrypt on a small, bounded thread pool (bcrypt releases the GIL while hashing). The request thread waits for
+    its hash, so this only helps with several request threads per process (gunicorn.conf.py runs gthread workers): at
+    most max_pending of them wait for hashes at a time, more are turned away right away and the other threads keep
+    serving. A single client can only keep max_per_client hashes busy. The limits hold per process. A hash counts
+    until it has actually finished, even if the request waiting for it gave up.
+    """
+
+    def __init__(self, rounds=12, workers=2, max_per_client=2, timeout=10, max_pending=4):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_per_client = max_per_client
+        self.timeout = timeout
+        self.max_pending = max_pending
+
+        self.executor = None
+        self.running = {}
+        self.pending = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def reset(self):
+        # The pool is started lazily, so a forked worker never inherits the threads of its parent
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.executor = None
+            self.running = {}
+            self.pending = 0
+            self.generation += 1  # Hashes of the old pool no longer count
+
+    def hash(self, password, client=None):
+        import bcrypt  # Imported on first use, most requests never hash a password
+        hashed = self._run(client, bcrypt.hashpw, password.encode(), bcrypt.gensalt(self.rounds))
+        return hashed.decode()
+
+    def check(self, password, hashed, client=None):
+        import bcrypt
+        return self._run(client, bcrypt.checkpw, password.encode(), hashed.encode())
+
+    def needs_rehash(self, hashed):
+        # bcrypt hashes look like $2b$<rounds>$<salt and hash>
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def _run(self, client, function, *args):
+        with self.lock:
+            if self.running.get(client, 0) >= self.max_per_client or self.pending >= self.max_pending:
+                raise TooManyAttempts()
+            self.running[client] = self.running.get(client, 0) + 1
+            self.pending += 1
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            executor = self.executor
+            generation = self.generation
+
+        try:
+            future = executor.submit(function, *args)
+        except BaseException:
+            self._done(client, generation)
+            raise
+        future.add_done_callback(lambda future: self._done(client, generation))
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()  # Still queued: it never runs. Already running: it keeps its slots until it's done.
+            raise TooManyAttempts()
+
+    def _done(self, client, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.pending -= 1
+            count = self.running.get(client, 1) - 1
+            if count > 0:
+                self.running[client] = count
+            else:
+                self.running.pop(client, None)
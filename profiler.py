@@ -0,0 +1,212 @@
+from collections import Counter
+from functools import wraps
+import cProfile
+import datetime
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from flask import request
+
+
+_name_re = re.compile(r'^[\w.-]+$')
+
+
+class Sampler(object):
+    """
+    Looks at the stack of one thread every interval seconds from a thread of its own and counts how often each stack
+    was seen, in the collapsed format flame graph tools read ('outer;inner;innermost count' per line). The profiled
+    code runs at full speed in between, so the overhead only depends on the interval.
+    """
+
+    def __init__(self, thread_id, interval, root_code):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root_code = root_code  # Frames from here up belong to the server, not to the request
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='profile-sampler')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and frame.f_code is not self.root_code:
+                stack.append(_label(frame))
+                frame = frame.f_back
+            if frame is not None and stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+            del frame
+
+    def collapsed(self):
+        return ''.join(stack + ' ' + str(count) + '\n' for stack, count in sorted(self.stacks.items()))
+
+
+def _label(frame):
+    return frame.f_globals.get('__name__', '?') + ':' + frame.f_code.co_name
+
+
+class Profiler(object):
+    """
+    Profiles the requests of admins who opt in with ?profile=1 or a profile=1 cookie. Each profiled request leaves a
+    collapsed-stack file from the Sampler and, if deterministic is set, cProfile stats in pstats format in folder,
+    where the admin pages list them. Only the newest keep profiles are kept.
+    """
+
+    opt_in = 'profile'  # Name of the query parameter and the cookie
+
+    def __init__(self, enabled=False, folder=None, interval=0.005, deterministic=False, keep=50):
+        self.enabled = enabled
+        self.folder = folder
+        self.interval = interval
+        self.deterministic = deterministic
+        self.keep = keep
+
+    def wrap_views(self, app, allowed):
+        """Wraps every view of app, so a request gets profiled if it asks for it and allowed() says it may."""
+        for endpoint, view in list(app.view_functions.items()):
+            if endpoint != 'static':
+                app.view_functions[endpoint] = self._wrap(view, allowed)
+
+    def _wrap(self, view, allowed):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if self.enabled and self.requested() and allowed():
+                return self.run(view, args, kwargs)
+            return view(*args, **kwargs)
+        return wrapper
+
+    def requested(self):
+        return request.args.get(self.opt_in) == '1' or request.cookies.get(self.opt_in) == '1'
+
+    def run(self, view, args, kwargs):
+        sampler = Sampler(threading.get_ident(), self.interval, Profiler.run.__code__)
+        profile = cProfile.Profile() if self.deterministic else None
+
+        started = datetime.datetime.now()
+        start = time.perf_counter()
+        sampler.start()
+        if profile is not None:
+            profile.enable()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.disable()
+            sampler.stop()
+            self.save(started, time.perf_counter() - start, sampler, profile)
+
+    def save(self, started, duration, sampler, profile):
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+        name = started.strftime('%Y%m%d-%H%M%S-%f') + '-' + re.sub(r'[^\w.-]', '_', request.endpoint or 'unknown')
+
+        with open(os.path.join(self.folder, name + '.collapsed'), 'w') as f:
+            f.write(sampler.collapsed())
+        if profile is not None:
+            profile.dump_stats(os.path.join(self.folder, name + '.pstats'))
+        with open(os.path.join(self.folder, name + '.json'), 'w') as f:
+            json.dump({'name': name,
+                       'method': request.method,
+                       'url': request.full_path.rstrip('?'),
+                       'endpoint': request.endpoint,
+                       'started': started.isoformat(),
+                       'duration': duration,
+                       'samples': sum(sampler.stacks.values()),
+                       'interval': sampler.interval,
+                       'deterministic': profile is not None}, f)
+
+        for old in self.profiles()[self.keep:]:
+            self.delete(old['name'])
+
+    def profiles(self):
+        """Metadata of the stored profiles, newest first."""
+        if not self.folder or not os.path.isdir(self.folder):
+            return []
+        profiles = []
+        for filename in sorted(os.listdir(self.folder), reverse=True):
+            if filename.endswith('.json'):
+                try:
+                    with open(os.path.join(self.folder, filename)) as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    pass  # Deleted or still being written by another process
+        return profiles
+
+    def profile(self, name):
+        for profile in self.profiles():
+            if profile['name'] == name:
+                return profile
+        return None
+
+    def path(self, name, extension):
+        if not _name_re.match(name):
+            return None
+        path = os.path.join(self.folder, name + extension)
+        return path if os.path.isfile(path) else None
+
+    def delete(self, name):
+        for extension in ('.json', '.collapsed', '.pstats'):
+            path = self.path(name, extension)
+            if path is not None:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats_text(self, name, limit=40):
+        """The functions with the most cumulative time, as printed by pstats."""
+        path = self.path(name, '.pstats')
+        if path is None:
+            return None
+        stream = io.StringIO()
+        pstats.Stats(path, stream=stream).strip_dirs().sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    def flame_graph(self, name, min_width=0.002):
+        """
+        Boxes of the flame graph of the collapsed stacks: (depth, left, width, label, samples), left and width as
+        fractions of all samples. Boxes narrower than min_width are left out.
+        """
+        path = self.path(name, '.collapsed')
+        if path is None:
+            return [], 0
+
+        root = {'children': {}, 'samples': 0}
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if not stack:
+                    continue
+                count = int(count)
+                root['samples'] += count
+                node = root
+                for label in stack.split(';'):
+                    node = node['children'].setdefault(label, {'children': {}, 'samples': 0})
+                    node['samples'] += count
+
+        total = root['samples']
+        boxes = []
+        pending = [(root, 0, -1)]
+        while pending:
+            node, left, depth = pending.pop()
+            for label in sorted(node['children']):
+                child = node['children'][label]
+                width = child['samples'] / float(total)
+                if width >= min_width:
+                    boxes.append((depth + 1, left, width, label, child['samples']))
+                    pending.append((child, left, depth + 1))
+                left += width
+        return boxes, total
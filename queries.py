@@ -0,0 +1,146 @@
+from collections import Counter
+import datetime
+from playhouse.postgres_ext import Match
+from models import Post, PostTag, Tag, PostUser, User, PostIndex, PostMonth, database, uses_sqlite
+
+
+# What a reader sees: admins every post, everybody else (logged in or not) the published ones. Public listings filter
+# and sort exactly like the partial index post_published_created_at, so Postgres can answer them from the index.
+
+def visible_posts(admin):
+    """Posts the reader may see, newest first."""
+    query = Post.select()
+    if not admin:
+        query = query.where(Post.published)
+    return query.order_by(Post.created_at.desc())
+
+
+def visible_post(slug, admin):
+    query = Post.select().where(Post.slug == slug)
+    if not admin:
+        query = query.where(Post.published)
+    return query.first()
+
+
+def posts_with_tag(tag_name, admin):
+    return visible_posts(admin).join(PostTag).join(Tag).where(Tag.name == tag_name)
+
+
+def posts_by_user(user_name, admin):
+    return visible_posts(admin).join(PostUser).join(User).where(User.name == user_name)
+
+
+def posts_in_period(year, month, admin):
+    """Posts created in a year, or in one month of it. A range on created_at, so the index answers it directly."""
+    start, end = period(year, month)
+    return visible_posts(admin).where((Post.created_at >= start) & (Post.created_at < end))
+
+
+def period(year, month=None):
+    """First moment of a year or month and the first moment after it."""
+    if month is None:
+        return datetime.datetime(year, 1, 1), datetime.datetime(year + 1, 1, 1)
+    if month == 12:
+        return datetime.datetime(year, 12, 1), datetime.datetime(year + 1, 1, 1)
+    return datetime.datetime(year, month, 1), datetime.datetime(year, month + 1, 1)
+
+
+def post_months():
+    """Months with published posts and their number of posts, newest first."""
+    return PostMonth.select().order_by(PostMonth.year.desc(), PostMonth.month.desc())
+
+
+def update_post_months(dates):
+    """Recounts the published posts of the months of dates, after posts of these months were saved or deleted."""
+    months = set((date.year, date.month) for date in dates if date is not None)
+    with database.atomic():
+        for year, month in months:
+            start, end = period(year, month)
+            count = Post.select()\
+                .where(Post.published & (Post.created_at >= start) & (Post.created_at < end))\
+                .count()
+            PostMonth.delete().where((PostMonth.year == year) & (PostMonth.month == month)).execute()
+            if count:
+                PostMonth.create(year=year, month=month, count=count)
+
+
+def rebuild_post_months():
+    """Recounts every month."""
+    counts = Counter((created_at.year, created_at.month) for (created_at,)
+                     in Post.select(Post.created_at).where(Post.published).tuples())
+    with database.atomic():
+        PostMonth.delete().execute()
+        rows = [{'year': year, 'month': month, 'count': count} for (year, month), count in counts.items()]
+        if rows:
+            PostMonth.insert_many(rows).execute()
+
+
+def search_posts(query, admin):
+    """Posts matching the query in their content, title or tags. Each part leaves out the matches of the ones before."""
+    if uses_sqlite():
+        return _search_index(query, admin)
+
+    query_str = "\'" + query + "\'" # the quotation marks are absolutely necessary for a pg tsquery with multiple words
+
+    matched_content = Post.select()\
+        .where(Match(Post.content, query_str) == True)
+    matched_title = Post.select()\
+        .where((Match(Post.title, query_str) == True)
+               & (Match(Post.content, query_str) == False))
+    matched_tag = Post.select().join(PostTag).join(Tag)\
+        .where((Match(Tag.name, query_str) == True)
+               & (Match(Post.title, query_str) == False)
+               & (Match(Post.content, query_str) == False))
+
+    if not admin:
+        matched_content = matched_content.where(Post.published)
+        matched_title = matched_title.where(Post.published)
+        matched_tag = matched_tag.where(Post.published)
+
+    return matched_content + matched_title + matched_tag
+
+
+def _search_index(query, admin):
+    # SQLite: every word of the query has to appear in the title, content or tags, best matches first. The words are
+    # quoted, so the FTS5 query syntax (AND, NEAR, *, column filters) in a search doesn't raise errors.
+    terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+    matched = Post.select()\
+        .join(PostIndex, on=(PostIndex.rowid == Post.id))\
+        .where(PostIndex.match(' AND '.join(terms) or '""'))\
+        .order_by(PostIndex.rank())
+    if not admin:
+        matched = matched.where(Post.published)
+    return matched
+
+
+def update_search_index(post_ids):
+    """Brings the SQLite full text index of the posts up to date, after they (or their tags) changed. Postgres searches
+    the tables directly, there's nothing to do."""
+    if not uses_sqlite() or not post_ids:
+        return
+    post_ids = list(post_ids)
+    with PostIndex._meta.database.atomic():
+        PostIndex.delete().where(PostIndex.rowid.in_(post_ids)).execute()
+        tags = {}
+        for post_id, tag_name in PostTag.select(PostTag.post, Tag.name).join(Tag)\
+                .where(PostTag.post.in_(post_ids)).tuples():
+            tags.setdefault(post_id, []).append(tag_name)
+        rows = [{PostIndex.rowid: post.id, PostIndex.title: post.title, PostIndex.content: post.content,
+                 PostIndex.tags: ' '.join(tags.get(post.id, []))}
+                for post in Post.select(Post.id, Post.title, Post.content).where(Post.id.in_(post_ids))]
+        if rows:
+            PostIndex.insert_many(rows).execute()
+
+
+def with_tags(posts):
+    """[post, tags] pairs for the listing templates, with the tags of all posts loaded in one query."""
+    posts = list(posts)
+    tags_by_post = dict((post.id, []) for post in posts)
+    if posts:
+        post_tags = PostTag.select(PostTag.post, Tag)\
+            .join(Tag)\
+            .where(PostTag.post.in_(list(tags_by_post)))\
+            .order_by(Tag.name)
+        for post_tag in post_tags:
+            tags_by_post[post_tag.post_id].append(post_tag.tag)
+    return [[post, tags_by_post[post.id]] for post in posts]
@@ -0,0 +1,40 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class RateLimiter(object):
+    """
+    Token bucket per client: every client may make burst requests at once and then rate requests per second. The
+    buckets are kept per process, for the least recently seen max_clients clients.
+    """
+
+    def __init__(self, rate=0.5, burst=10, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def allow(self, client):
+        now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[client] = (tokens, now)
+
+            # A client that fell out starts over with a full bucket, which only the longest idle ones do
+            while len(self.buckets) > self.max_clients:
+                self.buckets.popitem(last=False)
+        return allowed
+
+    def retry_after(self):
+        """Seconds until a client that ran out gets its next token."""
+        return int(1 / self.rate) + 1 if self.rate else 60
+
+    def clear(self):
+        with self.lock:
+            self.buckets = OrderedDict()
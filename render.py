@@ -0,0 +1,123 @@
+from collections import OrderedDict
+import hashlib
+import re
+import threading
+from models import Post
+
+
+_fence_re = re.compile(r'^ {0,3}(```|~~~)')
+_list_item_re = re.compile(r'^ {0,3}([*+-]|\d+[.)])\s')
+_indented_re = re.compile(r'^( {4}|\t)')
+_reference_re = re.compile(r'^ {0,3}\[[^\]]+\]:', re.M)
+_newline_re = re.compile(r'\r?\n')
+
+# Setting up a Markdown instance with all its extensions costs more than converting a short text, so every thread
+# keeps one around and resets it between documents
+_local = threading.local()
+
+
+def _markdown():
+    md = getattr(_local, 'markdown', None)
+    if md is None:
+        # Markdown and its extensions are imported on first use, pages served from content_html never need them.
+        # With Pygments installed the GFM fenced code extension highlights code blocks while rendering, so readers get
+        # finished html and no highlighting script (without it code blocks stay plain). Its css lives in
+        # static/css/highlight/pygments.min.css.
+        import markdown
+        from mdx_gfm import GithubFlavoredMarkdownExtension as GithubMarkdown
+        md = _local.markdown = markdown.Markdown(extensions=[GithubMarkdown()])
+    return md
+
+
+def render_markdown(raw_markdown):
+    return _markdown().reset().convert(raw_markdown or '')
+
+
+def post_html(post):
+    """Rendered content of a post. Posts saved before content_html existed get it rendered and stored on first view."""
+    if post.content_html is None:
+        post.content_html = render_markdown(post.content)
+        Post.update(content_html=post.content_html).where(Post.id == post.id).execute()
+    return post.content_html
+
+
+########################################
+###              Preview             ###
+########################################
+
+class BlockCache(object):
+    """LRU cache of rendered markdown blocks, keyed by the hash of their source."""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def render(self, block):
+        key = hashlib.sha1(block.encode('utf-8')).hexdigest()
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+                return html
+
+        html = render_markdown(block)
+
+        with self.lock:
+            self.entries[key] = html
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return html
+
+    def clear(self):
+        with self.lock:
+            self.entries = OrderedDict()
+
+
+preview_cache = BlockCache(2048)
+
+
+def split_blocks(raw_markdown):
+    """
+    Splits markdown into its top level blocks at blank lines. Fenced code stays in one block, as do indented lines and
+    list items that continue the block before them. static/js/compose_interactions.js splits the same way.
+    """
+    if _reference_re.search(raw_markdown):
+        return [raw_markdown]  # Reference links and footnotes resolve across blocks, so render the document as a whole
+
+    blocks, lines, fence, blank = [], [], None, False
+    for line in _newline_re.split(raw_markdown):
+        if fence is not None:
+            lines.append(line)
+            if line.strip().startswith(fence):
+                fence = None
+            continue
+
+        if not line.strip():
+            blank = bool(lines)
+            continue
+
+        if blank:
+            if _indented_re.match(line) or (_list_item_re.match(line) and _list_item_re.match(lines[0])):
+                lines.append('')
+            else:
+                blocks.append('\n'.join(lines))
+                lines = []
+            blank = False
+
+        fence_match = _fence_re.match(line)
+        if fence_match:
+            fence = fence_match.group(1)
+        lines.append(line)
+
+    if lines:
+        blocks.append('\n'.join(lines))
+    return blocks
+
+
+def render_blocks(blocks):
+    return [preview_cache.render(block) for block in blocks]
+
+
+def render_preview(raw_markdown):
+    return '\n'.join(render_blocks(split_blocks(raw_markdown or '')))
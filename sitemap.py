@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from xml.sax.saxutils import escape
+from flask import url_for
+from playhouse.postgres_ext import ServerSide
+from peewee import fn
+from models import Post, PostTag, Tag, PostUser, User, database, uses_sqlite
+import queries
+
+
+# Posts are split into shards by id: shard n lists the posts with ids n * SHARD_SIZE + 1 to (n + 1) * SHARD_SIZE,
+# so a shard never exceeds the 50,000 urls a sitemap may hold and a post never moves to another shard
+SHARD_SIZE = 50000
+INDEX_NAME = 'sitemap.xml'
+PAGES_NAME = 'sitemap-pages.xml'
+STATE_NAME = '.sitemap-state.json'
+
+_XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+_NAMESPACE = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+
+# One update at a time per process, concurrent requests for stale sitemaps wait for it instead of repeating it
+_lock = threading.Lock()
+
+
+def shard_name(shard):
+    return 'sitemap-posts-' + str(shard) + '.xml'
+
+
+def update(app, folder, base_url=None, log=print):
+    """
+    Brings the sitemaps in folder up to date: an index of one sitemap per shard of published posts (with the lastmod
+    of their updated_at) and one of the listing pages that lead to them. A shard is only written again if the count
+    or the newest updated_at of its posts changed. The urls in them are absolute ones below base_url.
+    """
+    with _lock, app.test_request_context(base_url=base_url):
+        return _update(folder, log)
+
+
+def is_stale(folder, max_age):
+    """Whether the sitemaps in folder are missing or were last brought up to date more than max_age seconds ago."""
+    try:
+        return os.path.getmtime(os.path.join(folder, STATE_NAME)) < time.time() - max_age
+    except OSError:
+        return True
+
+
+def _update(folder, log):
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+
+    state_path = os.path.join(folder, STATE_NAME)
+    previous = {}
+    if os.path.isfile(state_path):
+        with open(state_path) as f:
+            previous = json.load(f)
+
+    current = shard_versions()
+    written = 0
+    for shard, version in sorted(current.items()):
+        if previous.get(shard) != version or not os.path.isfile(os.path.join(folder, shard_name(int(shard)))):
+            _write(folder, shard_name(int(shard)), _urlset(_post_urls(int(shard))))
+            written += 1
+    for shard in set(previous) - set(current):
+        path = os.path.join(folder, shard_name(int(shard)))
+        if os.path.isfile(path):
+            os.remove(path)
+
+    # The listings are few and cheap to list, they get rewritten if anything in them differs
+    pages = _urlset(_page_urls())
+    if _write(folder, PAGES_NAME, pages, only_if_changed=True):
+        written += 1
+
+    sitemaps = [(PAGES_NAME, None)] + [(shard_name(int(shard)), version[1])
+                                       for shard, version in sorted(current.items(), key=lambda item: int(item[0]))]
+    _write(folder, INDEX_NAME, _sitemap_index(sitemaps), only_if_changed=True)
+
+    _write(folder, STATE_NAME, [json.dumps(current)])
+
+    log("Wrote " + str(written) + " sitemaps of " + str(len(current) + 1))
+    return written
+
+
+def shard_versions():
+    """Number of published posts and their newest updated_at per shard, in one grouped query."""
+    shard = (Post.id - 1) / SHARD_SIZE  # Integer division on both Postgres and SQLite
+    query = Post.select(shard, fn.Count(Post.id), fn.Max(Post.updated_at))\
+        .where(Post.published)\
+        .group_by(shard)\
+        .tuples()
+    versions = {}
+    for number, count, updated_at in query:
+        if not isinstance(updated_at, str):
+            updated_at = updated_at.isoformat()
+        versions[str(int(number))] = [count, updated_at]
+    return versions
+
+
+def _post_urls(shard):
+    # Streamed from a server-side cursor on Postgres, so a full shard never sits in memory at once
+    query = Post.select(Post.slug, Post.updated_at)\
+        .where(Post.published & (Post.id > shard * SHARD_SIZE) & (Post.id <= (shard + 1) * SHARD_SIZE))\
+        .order_by(Post.id)\
+        .tuples()
+    if uses_sqlite():
+        rows = query.iterator()
+    else:
+        rows = _server_side(query)
+    for slug, updated_at in rows:
+        yield url_for('post', slug=slug, _external=True), updated_at
+
+
+def _server_side(query):
+    # Named cursors only live inside a transaction
+    with database.atomic():
+        for row in ServerSide(query):
+            yield row
+
+
+def _page_urls():
+    yield url_for('blog', _external=True), None
+    for post_month in queries.post_months():
+        yield url_for('archive_view', year=post_month.year, month=post_month.month, _external=True), None
+    tags = Tag.select(Tag.name).join(PostTag).join(Post).where(Post.published).distinct().order_by(Tag.name).tuples()
+    for (tag_name,) in tags:
+        yield url_for('tag_view', tag_name=tag_name, _external=True), None
+    users = User.select(User.name).join(PostUser).join(Post).where(Post.published).distinct().order_by(User.name)\
+        .tuples()
+    for (user_name,) in users:
+        yield url_for('user_view', user_name=user_name, _external=True), None
+
+
+def _urlset(urls):
+    yield _XML_HEADER + '<urlset xmlns="' + _NAMESPACE + '">\n'
+    for url, lastmod in urls:
+        yield '<url><loc>' + escape(url) + '</loc>' + _lastmod(lastmod) + '</url>\n'
+    yield '</urlset>\n'
+
+
+def _sitemap_index(sitemaps):
+    yield _XML_HEADER + '<sitemapindex xmlns="' + _NAMESPACE + '">\n'
+    for name, lastmod in sitemaps:
+        yield '<sitemap><loc>' + escape(url_for('sitemap_file', name=name, _external=True)) + '</loc>' \
+              + _lastmod(lastmod) + '</sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+def _lastmod(lastmod):
+    if lastmod is None:
+        return ''
+    if not isinstance(lastmod, str):
+        lastmod = lastmod.isoformat()
+    return '<lastmod>' + lastmod[:10] + '</lastmod>'
+
+
+def _write(folder, name, chunks, only_if_changed=False):
+    """Writes the chunks into folder/name through a temporary file, so readers never see half a sitemap."""
+    path = os.path.join(folder, name)
+    temporary_path = path + '.' + str(os.getpid()) + '-' + str(threading.get_ident()) + '.tmp'
+    digest = hashlib.sha1()
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            digest.update(chunk.encode('utf-8'))
+
+    if only_if_changed and os.path.isfile(path) and _file_digest(path) == digest.digest():
+        os.remove(temporary_path)
+        return False
+    os.replace(temporary_path, path)
+    return True
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            digest.update(block)
+    return digest.digest()
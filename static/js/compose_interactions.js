@@ -35,42 +35,141 @@
 
   // Preview option
   (function() {
-   var clickHandler = function () {
-     var postFormData = { };
-     postFormData.title = postFormTitle.value.trim();
-     postFormData.content_markdown = postFormEditor.value();
-     postFormData.tags = postFormTags.value.trim().split(',');
+   // Rendered html of every block of the current content. Only blocks that are not in here get sent to Flask, so
+   // previews of long posts cost no more than those of short ones.
+   var blocksHtml = Object.create(null);
+   var fenceRe = /^ {0,3}(```|~~~)/;
+   var listItemRe = /^ {0,3}([*+-]|\d+[.)])\s/;
+   var indentedRe = /^( {4}|\t)/;
+   var referenceRe = /^ {0,3}\[[^\]]+\]:/m;
+   var previewTimeout = null;
+
+   // Has to split exactly like render.split_blocks
+   var splitBlocks = function (markdown) {
+     if (referenceRe.test(markdown)) {
+       return [markdown];
+     }
+
+     var blocks = [], lines = [], fence = null, blank = false;
+     var sourceLines = markdown.split(/\r?\n/);
+     for (var i = 0; i < sourceLines.length; i++) {
+       var line = sourceLines[i];
+       if (fence !== null) {
+         lines.push(line);
+         if (line.trim().indexOf(fence) === 0) {
+           fence = null;
+         }
+         continue;
+       }
+
+       if (line.trim() === "") {
+         blank = lines.length > 0;
+         continue;
+       }
+
+       if (blank) {
+         if (indentedRe.test(line) || (listItemRe.test(line) && listItemRe.test(lines[0]))) {
+           lines.push("");
+         } else {
+           blocks.push(lines.join("\n"));
+           lines = [];
+         }
+         blank = false;
+       }
+
+       var fenceMatch = fenceRe.exec(line);
+       if (fenceMatch) {
+         fence = fenceMatch[1];
+       }
+       lines.push(line);
+     }
+
+     if (lines.length > 0) {
+       blocks.push(lines.join("\n"));
+     }
+     return blocks;
+   };
+
+   var showPreview = function (blocks) {
+     var html = [];
+     var currentBlocksHtml = Object.create(null);
+     for (var i = 0; i < blocks.length; i++) {
+       html.push(blocksHtml[blocks[i]]);
+       currentBlocksHtml[blocks[i]] = blocksHtml[blocks[i]];
+     }
+     blocksHtml = currentBlocksHtml; // Forget blocks that are gone
+
+     postPreviewHeading.textContent = postFormTitle.value.trim();
+     postPreviewContent.innerHTML = html.join("\n");
+     postPreviewTags.innerHTML = "";
+     var tags = postFormTags.value.trim().split(',');
+     for (var j = 0; j < tags.length; j++) {
+       var postPreviewTag = document.createElement("a");
+       postPreviewTag.className = "level-item tag is-primary post-tag";
+       postPreviewTag.textContent = tags[j];
+       postPreviewTags.appendChild(postPreviewTag);
+     }
+
+     postPreview.style.display = "block";
+   };
 
-     // Http request: Flask translates markdown into html
+   var renderPreview = function (scroll) {
+     var blocks = splitBlocks(postFormEditor.value());
+     var missingBlocks = [];
+     for (var i = 0; i < blocks.length; i++) {
+       if (!(blocks[i] in blocksHtml) && missingBlocks.indexOf(blocks[i]) === -1) {
+         missingBlocks.push(blocks[i]);
+       }
+     }
+
+     var done = function () {
+       showPreview(blocks);
+       if (scroll) {
+         postPreview.scrollIntoView();
+       }
+     };
+
+     if (missingBlocks.length === 0) {
+       done();
+       return;
+     }
+
+     // Http request: Flask translates the markdown blocks into html
      var url = "/admin/preview";
-     var httpRequest = new XMLHttpinput-tagifyRequest();
+     var httpRequest = new XMLHttpRequest();
      httpRequest.open('POST', url);
      httpRequest.setRequestHeader("Content-Type", "application/json");
-     // If http request is success, set post title, description, content & tags and unhide it to preview
 
      httpRequest.onload = function () {
-       var postPreviewContent_html = JSON.parse(httpRequest.response)["html"];
-
-       postPreviewHeading.innerHTML = postFormData.postTitle;
-       postPreviewContent.innerHTML = postPreviewContent_html;
-       for (var i = 0; i < postFormData.tags.length; i++) {
-         var postPreviewTag_html = '<a class="level-item tag is-primary post-tag">' + postFormData.tags[i] + '</a>';
-         postPreviewTags.insertAdjacentHTML('beforeend', postPreviewTag_html);
+       var renderedBlocks = JSON.parse(httpRequest.response)["blocks"];
+       for (var i = 0; i < missingBlocks.length; i++) {
+         blocksHtml[missingBlocks[i]] = renderedBlocks[i];
        }
-
-       postPreview.style.display = "block";
-       postPreviewBox.scrollIntoView();
-//     let  dateTime = JSON.parse(httpRequest.response)["date_time"];
-//     postPreviewCurrentDateTime.innerHTML = dateTime;
-        };
+       done();
+     };
      httpRequest.onerror = function () {
-          alert("Request contained an error");
-        };
-     httpRequest.send(JSON.stringify(postFormData));
+       alert("Request contained an error");
+     };
+     httpRequest.send(JSON.stringify({blocks: missingBlocks}));
+   };
+
+   var clickHandler = function () {
+     renderPreview(true);
    };
 
    var anchor = document.getElementById("action-preview");
    anchor.addEventListener('click', clickHandler, false);
+
+   // Once the preview is open it follows the editor
+   postFormEditor.codemirror.on("change", function () {
+     if (postPreview.style.display !== "block") {
+       return;
+     }
+     clearTimeout(previewTimeout);
+     previewTimeout = setTimeout(function () {
+       renderPreview(false);
+     }, 300);
+   });
  })();
 
   // Delete option
@@ -1 +1,16 @@
-(function(){var postForm=document.getElementById("post-form");var postFormTitle=document.getElementById("post-form-title");var postFormTags=document.getElementById("post-form-tags");var postFormPublishSwitch=document.getElementById("post-form-publish-switch");var postFormPublishSwitchLabel=document.getElementById("post-form-publish-switch-label");var postFormSubmitButton=document.getElementById("post-form-submit-button");var postPreview=document.getElementById("preview");var postPreviewBox=document.getElementById("preview-box");var postPreviewHeading=document.getElementsByClassName("post-heading")[0];var postPreviewContent=document.getElementsByClassName("post-content")[0];var postPreviewTags=document.getElementsByClassName("post-tags")[0];(function(){var clickHandler=function(){postFormPublishSwitch.checked=false;postForm.submit()};var anchor=document.getElementById("action-draft");anchor.addEventListener("click",clickHandler,false)})();(function(){var clickHandler=function(){var postFormData={};postFormData.title=postFormTitle.value.trim();postFormData.content_markdown=postFormEditor.value();postFormData.tags=postFormTags.value.trim().split(",");var url="/admin/preview";var httpRequest=new XMLHttpinput-tagifyRequest();httpRequest.open("POST",url);httpRequest.setRequestHeader("Content-Type","application/json");httpRequest.onload=function(){var postPreviewContent_html=JSON.parse(httpRequest.response)["html"];postPreviewHeading.innerHTML=postFormData.postTitle;postPreviewContent.innerHTML=postPreviewContent_html;for(var i=0;i<postFormData.tags.length;i++){var postPreviewTag_html='<a class="level-item tag is-primary post-tag">'+postFormData.tags[i]+"</a>";postPreviewTags.insertAdjacentHTML("beforeend",postPreviewTag_html)}postPreview.style.display="block";postPreviewBox.scrollIntoView()};httpRequest.onerror=function(){alert("Request contained an error")};httpRequest.send(JSON.stringify(postFormData))};var anchor=document.getElementById("action-preview");anchor.addEventListener("click",clickHandler,false)})();(function(){var clickHandler=function(){var editId=document.getElementsByName("post-edit-id")[0];if(typeof editId!=="undefined"&&editId!=null){editId=editId.value.trim();if(confirm("Are you sure you want to delete post "+editId+"?")){var url="/admin/posts/delete";var data=JSON.stringify({id:editId,was_edit:true});var httpRequest=new XMLHttpRequest;httpRequest.open("POST",url);httpRequest.setRequestHeader("Content-Type","application/json");httpRequest.onload=function(){if(JSON.parse(httpRequest.response)["ok"]===true){window.location="/admin/posts"}else{location.reload(true)}};httpRequest.onerror=function(){alert("Delete request contained an error")};httpRequest.send(data)}}else{window.location="/admin/posts"}};var anchor=document.getElementById("action-delete-post");anchor.addEventListener("click",clickHandler,false)})();(function(){var clickHandler=function(){postFormSubmitButton.innerHTML=postFormPublishSwitch.checked?"Post":"Save";postFormPublishSwitchLabel.innerHTML=postFormPublishSwitch.checked?"Publish":"Draft"};var anchor=document.getElementById("post-form-publish-switch");anchor.addEventListener("click",clickHandler,false)})()})();
\ No newline at end of file
+(function(){var postForm=document.getElementById('post-form');var postFormTitle=document.getElementById("post-form-title");var postFormTags=document.getElementById('post-form-tags');var postFormPublishSwitch=document.getElementById('post-form-publish-switch');var postFormPublishSwitchLabel=document.getElementById('post-form-publish-switch-label');var postFormSubmitButton=document.getElementById('post-form-submit-button');var postPreview=document.getElementById("preview");var postPreviewBox=document.getElementById("preview-box");var postPreviewHeading=document.getElementsByClassName("post-heading")[0];var postPreviewContent=document.getElementsByClassName("post-content")[0];var postPreviewTags=document.getElementsByClassName("post-tags")[0];(function(){var clickHandler=function(){postFormPublishSwitch.checked=false;postForm.submit();};var anchor=document.getElementById("action-draft");anchor.addEventListener('click',clickHandler,false);})();(function(){var blocksHtml=Object.create(null);var fenceRe=/^ {0,3}(```|~~~)/;var listItemRe=/^ {0,3}([*+-]|\d+[.)])\s/;var indentedRe=/^( {4}|\t)/;var referenceRe=/^ {0,3}\[[^\]]+\]:/m;var previewTimeout=null;var splitBlocks=function(markdown){if(referenceRe.test(markdown)){return[markdown];}
+var blocks=[],lines=[],fence=null,blank=false;var sourceLines=markdown.split(/\r?\n/);for(var i=0;i<sourceLines.length;i++){var line=sourceLines[i];if(fence!==null){lines.push(line);if(line.trim().indexOf(fence)===0){fence=null;}
+continue;}
+if(line.trim()===""){blank=lines.length>0;continue;}
+if(blank){if(indentedRe.test(line)||(listItemRe.test(line)&&listItemRe.test(lines[0]))){lines.push("");}else{blocks.push(lines.join("\n"));lines=[];}
+blank=false;}
+var fenceMatch=fenceRe.exec(line);if(fenceMatch){fence=fenceMatch[1];}
+lines.push(line);}
+if(lines.length>0){blocks.push(lines.join("\n"));}
+return blocks;};var showPreview=function(blocks){var html=[];var currentBlocksHtml=Object.create(null);for(var i=0;i<blocks.length;i++){html.push(blocksHtml[blocks[i]]);currentBlocksHtml[blocks[i]]=blocksHtml[blocks[i]];}
+blocksHtml=currentBlocksHtml;postPreviewHeading.textContent=postFormTitle.value.trim();postPreviewContent.innerHTML=html.join("\n");postPreviewTags.innerHTML="";var tags=postFormTags.value.trim().split(',');for(var j=0;j<tags.length;j++){var postPreviewTag=document.createElement("a");postPreviewTag.className="level-item tag is-primary post-tag";postPreviewTag.textContent=tags[j];postPreviewTags.appendChild(postPreviewTag);}
+postPreview.style.display="block";};var renderPreview=function(scroll){var blocks=splitBlocks(postFormEditor.value());var missingBlocks=[];for(var i=0;i<blocks.length;i++){if(!(blocks[i]in blocksHtml)&&missingBlocks.indexOf(blocks[i])===-1){missingBlocks.push(blocks[i]);}}
+var done=function(){showPreview(blocks);if(scroll){postPreview.scrollIntoView();}};if(missingBlocks.length===0){done();return;}
+var url="/admin/preview";var httpRequest=new XMLHttpRequest();httpRequest.open('POST',url);httpRequest.setRequestHeader("Content-Type","application/json");httpRequest.onload=function(){var renderedBlocks=JSON.parse(httpRequest.response)["blocks"];for(var i=0;i<missingBlocks.length;i++){blocksHtml[missingBlocks[i]]=renderedBlocks[i];}
+done();};httpRequest.onerror=function(){alert("Request contained an error");};httpRequest.send(JSON.stringify({blocks:missingBlocks}));};var clickHandler=function(){renderPreview(true);};var anchor=document.getElementById("action-preview");anchor.addEventListener('click',clickHandler,false);postFormEditor.codemirror.on("change",function(){if(postPreview.style.display!=="block"){return;}
+clearTimeout(previewTimeout);previewTimeout=setTimeout(function(){renderPreview(false);},300);});})();(function(){var clickHandler=function(){var editId=document.getElementsByName("post-edit-id")[0];if(typeof(editId)!=='undefined'&&editId!=null){editId=editId.value.trim();if(confirm("Are you sure you want to delete post "+editId+"?")){var url="/admin/posts/delete";var data=JSON.stringify({id:editId,was_edit:true});var httpRequest=new XMLHttpRequest();httpRequest.open('POST',url);httpRequest.setRequestHeader("Content-Type","application/json");httpRequest.onload=function(){if(JSON.parse(httpRequest.response)["ok"]===true){window.location="/admin/posts";}else{location.reload(true);}};httpRequest.onerror=function(){alert("Delete request contained an error");};httpRequest.send(data);}}else{window.location="/admin/posts";}};var anchor=document.getElementById("action-delete-post");anchor.addEventListener('click',clickHandler,false);})();(function(){var clickHandler=function(){postFormSubmitButton.innerHTML=postFormPublishSwitch.checked?"Post":"Save";postFormPublishSwitchLabel.innerHTML=postFormPublishSwitch.checked?"Publish":"Draft";};var anchor=document.getElementById("post-form-publish-switch");anchor.addEventListener('click',clickHandler,false);})();})();
\ No newline at end of file
@@ -0,0 +1,58 @@
+import util
+from models import Post
+
+
+def test_apps_keep_their_own_database_and_state(make_app):
+    first = make_app('first', SEARCH_BURST=1)
+    second = make_app('second', SEARCH_BURST=5)
+
+    with first.app_context():
+        Post.create(title='Ramen', description='d', content='x', slug='ramen', published=True)
+    with second.app_context():
+        assert Post.select().count() == 0
+    with first.app_context():
+        assert Post.select().count() == 1
+
+    for name in ('database', 'recent_posts', 'user_cache', 'post_slugs', 'search_results', 'search_limiter', 'hasher',
+                 'compressor', 'profiler'):
+        assert first.extensions[name] is not second.extensions[name], name
+    assert first.extensions['search_limiter'].burst == 1 and second.extensions['search_limiter'].burst == 5
+
+    assert first.test_client().get('/recipes/ramen').status_code == 200
+    assert second.test_client().get('/recipes/ramen').status_code == 404
+
+
+def admin_client(application):
+    client = application.test_client()
+    client.get('/init')
+    client.post('/login/go', data={'username': 'admin', 'password': 'password'})
+    return client
+
+
+def test_preview_rejects_malformed_payloads(make_app):
+    client = admin_client(make_app(PREVIEW_MAX_BLOCKS=3))
+
+    response = client.post('/admin/preview', json={'blocks': ['# Ramen', 'Boil *noodles*']})
+    assert response.status_code == 200 and len(response.get_json()['blocks']) == 2
+    for payload in ({}, [], {'blocks': 'Ramen'}, {'blocks': ['Ramen', 5]}, {'blocks': ['x'] * 4},
+                    {'postContent_markdown': None}):
+        assert client.post('/admin/preview', json=payload).status_code == 400, payload
+
+
+def test_settings_reject_a_bad_number_of_recent_posts(make_app):
+    application = make_app()
+    client = admin_client(application)
+    with application.app_context():
+        form = {'blog-title': 'Blog', 'icon-1-link': '', 'icon-1-icon-type': 'github', 'icon-2-link': '',
+                'icon-2-icon-type': 'linkedin', 'posts-per-page': '10', 'max-synopsis-chars': '500',
+                'table-entries-per-page': '14'}
+        util.get_current_settings()
+
+        for value in ('', 'five', '0', '-2', '2.5'):
+            form['number-of-recent-posts'] = value
+            assert client.post('/admin/settings/save', data=form).status_code == 302, value
+            assert util.get_current_settings().number_of_recent_posts == 5
+
+        form['number-of-recent-posts'] = '3'
+        client.post('/admin/settings/save', data=form)
+        assert util.get_current_settings().number_of_recent_posts == 3
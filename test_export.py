@@ -0,0 +1,41 @@
+import datetime
+import os
+import export
+import util
+from models import Post, PostTag, Tag
+
+
+def publish(title, created_at, tag=None):
+    post = Post.create(title=title, description='d', content='x', slug=title.lower(), published=True,
+                       created_at=created_at, first_published_at=created_at)
+    if tag is not None:
+        PostTag.create(post=post, tag=tag)
+    return post
+
+
+def test_incremental_export_renders_only_affected_pages(make_app, tmp_path):
+    application = make_app()
+    site = str(tmp_path / 'site')
+    with application.app_context():
+        util.get_current_settings()
+        soup = Tag.create(name='soup')
+        for day in range(1, 4):
+            publish('Old' + str(day), datetime.datetime(2020, 1, day), tag=soup)
+        publish('Curry', datetime.datetime(2020, 2, 1))
+        export.export(application, site, processes=1, log=lambda message: None)
+        build = os.path.realpath(site)
+
+        # A new post changes the recent posts and the counts per month, but not the other posts' pages
+        publish('Ramen', datetime.datetime(2020, 3, 1))
+        rendered = export.export(application, site, processes=1, incremental=True, log=lambda message: None)
+        assert os.path.realpath(site) == build
+        assert {'/recipes/ramen', '/blog', '/blog/2020/3', '/feed.xml'} <= rendered
+        assert '/recipes/old1' not in rendered and '/blog/2020/1' not in rendered
+
+        # Renaming a tag changes the pages of the posts that carry it
+        soup.name = 'soups'
+        soup.save()
+        rendered = export.export(application, site, processes=1, incremental=True, log=lambda message: None)
+        assert {'/recipes/old1', '/recipes/old2', '/recipes/old3', '/tag/soups'} <= rendered
+        assert '/recipes/curry' not in rendered
+        assert not os.path.exists(os.path.join(site, 'tag', 'soup', 'index.html'))
@@ -0,0 +1,38 @@
+import datetime
+import pytest
+import jobs
+from models import Job, database, init_database
+
+
+@pytest.fixture
+def queue():
+    init_database('sqlite:///:memory:')
+    database.create_tables([Job])
+    database.execute_sql("CREATE UNIQUE INDEX job_pending_kind_key ON job (kind, key) WHERE status = 'pending'")
+    yield
+    jobs.handlers.pop('test', None)
+    database.close()
+
+
+def test_retry_of_a_job_queued_again_while_it_ran_is_superseded(queue):
+    @jobs.handler('test')
+    def fail(key, payload):
+        jobs.enqueue('test', key)  # Saved again while running, like a post saved during its export
+        raise ValueError('boom')
+
+    jobs.enqueue('test', 'site')
+    job = jobs.claim(timeout=300)
+    assert jobs.run(job) == 'superseded'
+    assert 'boom' in Job.get_by_id(job.id).last_error
+    assert [j.status for j in Job.select().order_by(Job.id)] == ['superseded', 'pending']
+
+
+def test_stale_jobs_that_used_up_their_attempts_fail(queue):
+    long_ago = datetime.datetime.now() - datetime.timedelta(hours=1)
+    Job.create(kind='test', key='dead', status='running', attempts=3, max_attempts=3, updated_at=long_ago)
+    retried = Job.create(kind='test', key='alive', status='running', attempts=1, max_attempts=3, updated_at=long_ago)
+
+    job = jobs.claim(timeout=300)
+    assert job.id == retried.id and job.attempts == 2
+    assert Job.get(Job.key == 'dead').status == 'failed'
+    assert jobs.claim(timeout=300) is None
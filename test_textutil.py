@@ -0,0 +1,67 @@
+import random
+import textutil
+
+
+# Titles as they come in: mixed scripts, accents, punctuation, runs of separators, very long ones
+ALPHABET = (u"abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789      -_.,!?&/()'\"–—"
+            u"äöüßéèêçñøæœłđþ불고기라면김치Пельмени墨西哥卷饼مسالاचायต้มยำกุ้ง́̈ＦＵＬ")
+EXAMPLES = [u"Bulgogi – 불고기", u"Crème brûlée", u"Mac & Cheese", u"Pelmeni / Пельмени", u"मसाला चाय", u"ต้มยำกุ้ง",
+            u"ＦＵＬＬＷＩＤＴＨ ramen", u"Straße_Brot", u"  --  ", u"", u"a very long title " * 10]
+
+
+def random_titles(count=500, seed=1):
+    generator = random.Random(seed)
+    return [u''.join(generator.choice(ALPHABET) for _ in range(generator.randint(0, 120))) for _ in range(count)]
+
+
+def titles():
+    return EXAMPLES + random_titles()
+
+
+def test_slugify_is_idempotent():
+    for title in titles():
+        slug = textutil.slugify(title)
+        assert textutil.slugify(slug) == slug, title
+
+
+def test_slugs_fit_max_length():
+    for title in titles():
+        assert len(textutil.slugify(title)) <= textutil.MAX_LENGTH, title
+        assert len(textutil.slugify(title, max_length=10)) <= 10, title
+
+
+def test_slugs_neither_start_nor_end_with_the_delimiter():
+    for title in titles():
+        for delim in (u'-', u'_'):
+            slug = textutil.slugify(title, delim=delim)
+            assert not slug.startswith(delim) and not slug.endswith(delim), title
+            assert delim + delim not in slug, title
+
+
+def test_slugs_are_lower_case_words():
+    assert textutil.slugify(u"Bulgogi – 불고기") == u"bulgogi-불고기"
+    assert textutil.slugify(u"Crème brûlée") == u"creme-brulee"
+    assert textutil.slugify(u"Mac & Cheese") == u"mac-and-cheese"
+    assert textutil.slugify(u"Straße_Brot") == u"strasse-brot"
+    assert textutil.slugify(u"  --  ") == u""
+
+
+def test_slugify_all_is_unique_and_avoids_taken():
+    batch = titles() + titles()[:50] + [u"Ramen", u"ramen!", u"RAMEN", u"ramen 2"]
+    taken = set([u"ramen", u"ramen-2", u"recipe", u"bulgogi-불고기"])
+    slugs = textutil.slugify_all(batch, taken=taken)
+    assert len(slugs) == len(batch)
+    assert len(set(slugs)) == len(slugs)
+    assert not set(slugs) & taken
+    for slug in slugs:
+        assert slug and len(slug) <= textutil.MAX_LENGTH
+        assert not slug.startswith(u'-') and not slug.endswith(u'-')
+
+
+def test_unique_numbers_stay_within_max_length():
+    slug = textutil.slugify(u"x" * 200)
+    taken = set([slug])
+    for _ in range(20):
+        candidate = textutil.unique(slug, taken)
+        assert len(candidate) <= textutil.MAX_LENGTH and candidate not in taken
+        taken.add(candidate)
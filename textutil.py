@@ -0,0 +1,73 @@
+import re
+import unicodedata
+
+
+# Longest slug slugify returns, cut at a word boundary where possible
+MAX_LENGTH = 80
+
+# Letters NFKD does not decompose into a base letter and a diacritic
+_TRANSLITERATIONS = {
+    u'ß': u'ss', u'æ': u'ae', u'Æ': u'ae', u'œ': u'oe', u'Œ': u'oe', u'ø': u'o', u'Ø': u'o', u'ł': u'l', u'Ł': u'l',
+    u'đ': u'd', u'Đ': u'd', u'ð': u'd', u'Ð': u'd', u'þ': u'th', u'Þ': u'th', u'ı': u'i', u'&': u' and ',
+}
+_transliteration_table = dict((ord(char), replacement) for char, replacement in _TRANSLITERATIONS.items())
+
+# Combining diacritical marks (the accents of Latin, Greek and Cyrillic letters once NFKD split them off)
+_diacritics_re = re.compile(u'[\u0300-\u036f]+')
+
+# Everything but letters and digits of any script separates words. The vowel signs and points of Hebrew, Arabic and
+# the Indic and South East Asian scripts are part of their words, even though \w does not match them.
+_separator_re = re.compile(u'(?:[^\\w\u0591-\u05c7\u064b-\u065f\u0900-\u0dff\u0e00-\u0eff\u1000-\u109f]|_)+')
+
+
+def transliterate(text):
+    """
+    Replaces accented Latin, Greek and Cyrillic letters by their base letters (crème brûlée -> creme brulee) and
+    ligatures and compatibility characters by their plain forms. Letters of other scripts are kept.
+    """
+    text = text.translate(_transliteration_table)
+    try:
+        text.encode('ascii')
+        return text  # Most titles are plain ASCII, nothing to normalize
+    except UnicodeEncodeError:
+        pass
+    text = unicodedata.normalize('NFKD', text)
+    return unicodedata.normalize('NFC', _diacritics_re.sub(u'', text))
+
+
+def slugify(text, delim=u'-', max_length=MAX_LENGTH):
+    """
+    Generates a lower case slug of the words in text: "Bulgogi – 불고기" -> "bulgogi-불고기". Letters of scripts without
+    a transliteration stay as they are, browsers show them in the address bar.
+    """
+    slug = delim.join(word for word in _separator_re.split(transliterate(text or u'').lower()) if word)
+    if max_length and len(slug) > max_length:
+        cut = slug.rfind(delim, 0, max_length + 1)
+        slug = slug[:cut] if cut > 0 else slug[:max_length]
+    return slug
+
+
+def unique(slug, taken, delim=u'-', max_length=MAX_LENGTH):
+    """First of slug, slug-2, slug-3, ... that is not in taken. The number still fits into max_length."""
+    candidate, number = slug, 1
+    while candidate in taken:
+        number += 1
+        suffix = delim + str(number)
+        base = slug[:max_length - len(suffix)].rstrip(delim) if max_length else slug
+        candidate = base + suffix
+    return candidate
+
+
+def slugify_all(texts, taken=(), delim=u'-', max_length=MAX_LENGTH, default=u'recipe'):
+    """
+    Slugs for a batch of titles (an import, say) that are unique among each other and not in taken, so the database
+    only needs to be asked for the taken slugs once.
+    """
+    taken = set(taken)
+    slugs = []
+    for text in texts:
+        slug = unique(slugify(text, delim, max_length) or default, taken, delim, max_length)
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
@@ -1,15 +1,34 @@
-import re
-from models import Settings
+from flask import request, current_app
+from peewee import fn
+from models import Settings, Post
+from textutil import slugify
+import textutil
 
 
-def slugify(text, delim=u'-'):
-    _punct_re = re.compile(r'[\t !"#$%&\'()*\-/<=>?@\[\\\]^_`{|},.]+')
-    """Generates an ASCII-only slug."""
-    result = []
-    for word in _punct_re.split(text.lower()):
-        if word:
-            result.append(word)
-    return delim.join(result)
+def unique_slug(title, post_id=None):
+    """Slug of the title that no other post uses yet. Collisions get a number appended: ramen, ramen-2, ramen-3, ..."""
+    slug = slugify(title or '') or 'recipe'
+    # Numbered variants of a long slug get cut short to fit, so only compare the part every variant keeps
+    taken = Post.select(Post.slug).where(Post.slug.startswith(slug[:textutil.MAX_LENGTH - 6]))
+    if post_id is not None:
+        taken = taken.where(Post.id != post_id)
+    return textutil.unique(slug, set(post.slug for post in taken))
+
+def deduplicate_slugs():
+    """Gives posts that share a slug (from before slugs were unique) unique ones. The oldest post keeps its slug."""
+    duplicates = Post.select(Post.slug).group_by(Post.slug).having(fn.COUNT(Post.id) > 1)
+    for post in Post.select().where(Post.slug.in_(duplicates)).order_by(Post.id):
+        if Post.select().where((Post.slug == post.slug) & (Post.id < post.id)).exists():
+            post.slug = unique_slug(post.title, post.id)
+            post.save()
+
+def client_address():
+    """The client's address, taken from X-Forwarded-For if the app runs behind PROXY_COUNT proxies."""
+    proxy_count = current_app.config.get('PROXY_COUNT', 0)
+    if proxy_count and 'X-Forwarded-For' in request.headers:
+        route = request.access_route  # Addresses from X-Forwarded-For, the client's first
+        return route[-proxy_count] if len(route) >= proxy_count else route[0]
+    return request.remote_addr
 
 def get_current_settings():
     try:
@@ -23,8 +42,74 @@ def get_current_settings():
                                            icon_2_icon_type='linkedin',
                                            posts_per_page=10,
                                            max_synopsis_chars=500,
+                                           number_of_recent_posts=5,
                                            table_entries_per_page=14)
         current_settings.save()
     return current_settings
 
+def add_missing_columns(database, models):
+    """Adds columns of fields that were introduced after a model's table was created."""
+    from playhouse.migrate import SchemaMigrator, migrate  # Only 'flask initdb' needs it
+    migrator = SchemaMigrator.from_database(database)
+    operations = []
+    for model in models:
+        table = model._meta.table_name
+        existing_columns = [column.name for column in database.get_columns(table)]
+        for field in model._meta.sorted_fields:
+            if field.column_name not in existing_columns:
+                operations.append(migrator.add_column(table, field.column_name, field))
+    if operations:
+        migrate(*operations)
+
+
+class DeferredApp(object):
+    """
+    Stands in for the Flask app while app.py declares its routes, error handlers, template helpers and commands with
+    the usual decorators, and registers all of them on every app create_app builds.
+
+    A blueprint doesn't fit: Flask 1.0 blueprints can't declare cli commands (initdb, worker, export, ...), and their
+    endpoints get prefixed with the blueprint's name, which would change every url_for in the templates, export.py and
+    sitemap.py and flask-login's login_view.
+    """
+
+    def __init__(self):
+        self.deferred = []
+        self.cli = _DeferredCli(self)
+
+    def defer(self, register):
+        """Decorator that calls register(app, f) for every app."""
+        def decorator(f):
+            self.deferred.append((register, f))
+            return f
+        return decorator
+
+    def route(self, rule, **options):
+        return self.defer(lambda app, f: app.route(rule, **options)(f))
+
+    def errorhandler(self, code_or_exception):
+        return self.defer(lambda app, f: app.errorhandler(code_or_exception)(f))
+
+    def after_request(self, f):
+        return self.defer(lambda app, f: app.after_request(f))(f)
+
+    def context_processor(self, f):
+        return self.defer(lambda app, f: app.context_processor(f))(f)
+
+    def template_filter(self, name=None):
+        return self.defer(lambda app, f: app.add_template_filter(f, name))
+
+    def template_global(self, name=None):
+        return self.defer(lambda app, f: app.add_template_global(f, name))
+
+    def register(self, app):
+        for register, f in self.deferred:
+            register(app, f)
+
+
+class _DeferredCli(object):
+
+    def __init__(self, deferred_app):
+        self.deferred_app = deferred_app
 
+    def command(self, *args, **kwargs):
+        return self.deferred_app.defer(lambda app, f: app.cli.command(*args, **kwargs)(f))